@@ -1,4 +1,7 @@
-import asyncio, signal
+import asyncio, signal, time
+
+# startup timing reference, taken before the heavy imports
+STARTED = time.perf_counter()
 
 from contextlib import suppress
 from aiogram import Bot, Dispatcher, html
@@ -11,10 +14,34 @@ from modules.logger import init_logger
 from modules.config import config
 from modules.handlers import router
 from modules.db.models import init_db
-from modules.tracking import start_tracking
+from modules.pools import close_pools
+from modules.tracking import start_tracking, start_digest
+from modules.outbox import start_outbox
+from modules.debug import setup_debug_loop, setup_debug_routes, setup_debug_signals
 
 logger = init_logger(__name__)
 
+# startup phases and the moments they finished
+startup_phases: list[tuple[str, float]] = []
+
+
+def startup_phase(name: str):
+    """
+    Marks the end of a startup phase.
+    """
+    startup_phases.append((name, time.perf_counter()))
+
+
+def log_startup():
+    """
+    Reports how long each startup phase took.
+    """
+    previous, parts = STARTED, []
+    for name, finished in startup_phases:
+        parts.append(f"{name} {(finished - previous) * 1000:.0f} ms")
+        previous = finished
+    logger.info(f"Startup took {(previous - STARTED) * 1000:.0f} ms: {', '.join(parts)}")
+
 
 async def on_startup(app: web.Application):
     """
@@ -22,19 +49,26 @@ async def on_startup(app: web.Application):
     """
 
     logger.info("Starting the application.")
+    setup_debug_loop()
 
     # database initialization
     await init_db()
+    startup_phase("database")
 
     # setting up webhook if specified
     if config.WEBHOOK_URL:
         await bot.set_webhook(url=config.WEBHOOK_URL)
         logger.info(f"Webhook set to {config.WEBHOOK_URL}")
+        startup_phase("webhook")
 
     # start tracking
-    app["tracking"] = asyncio.create_task(start_tracking(bot))
+    app["tracking"] = asyncio.create_task(start_tracking())
     logger.info("Tracking task started.")
 
+    # start digest and notification delivery, pending notifications resume here
+    app["digest"] = asyncio.create_task(start_digest())
+    app["outbox"] = asyncio.create_task(start_outbox(bot))
+
 
 async def on_shutdown(app: web.Application):
     """
@@ -43,16 +77,18 @@ async def on_shutdown(app: web.Application):
 
     logger.info("Shutting down the application...")
 
-    # terminating the background task
-    tracking_task = app.get("tracking")
-    if tracking_task:
-        tracking_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await tracking_task
+    # terminating the background tasks
+    for name in ("tracking", "digest", "outbox"):
+        task = app.get(name)
+        if task:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
 
-    # removing webhook and close session
+    # removing webhook and close sessions
     if config.WEBHOOK_URL:
         await bot.delete_webhook()
+    await close_pools()
     await bot.session.close()
     logger.info("Bot session closed.")
 
@@ -86,6 +122,7 @@ async def shutdown(loop: asyncio.AbstractEventLoop, signal=None):
 
 
 async def main():
+    startup_phase("imports")
 
     # bot cofiguration
     global bot
@@ -99,6 +136,7 @@ async def main():
 
     dp = Dispatcher()
     dp.include_router(router)
+    startup_phase("bot setup")
 
     # webhook mode
     if config.WEBHOOK_URL:
@@ -108,17 +146,37 @@ async def main():
 
         SimpleRequestHandler(dp, bot).register(webapp, "/webhook")
         setup_application(webapp, dp, bot=bot)
+        setup_debug_routes(webapp)
 
+        # serving inside the running loop, web.run_app would try to start its own
+        runner = web.AppRunner(webapp, handle_signals=True)
+        await runner.setup()
+        await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+        startup_phase("server")
         logger.info(f"Running server on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}")
-        web.run_app(webapp, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+        log_startup()
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
 
     # polling mode
     else:
         logger.info(f"No webhook was specified. Working in polling mode.")
+        setup_debug_loop()
+        setup_debug_signals(asyncio.get_running_loop())
         await init_db()
-        asyncio.create_task(start_tracking(bot))
-
-        await dp.start_polling(bot)
+        startup_phase("database")
+        asyncio.create_task(start_tracking())
+        asyncio.create_task(start_digest())
+        asyncio.create_task(start_outbox(bot))
+        log_startup()
+
+        try:
+            await dp.start_polling(bot)
+        finally:
+            await close_pools()
 
 
 if __name__ == "__main__":
@@ -10,6 +10,34 @@ class Configuration:
     WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
     # polling
     POLL_INTERVAL: int = int(os.getenv("CHECK_INTERVAL", "300"))
+    # provider connection pools: per-host defaults and self-hosted instances (JSON list)
+    POOL_CONCURRENCY: int = int(os.getenv("POOL_CONCURRENCY", "8"))
+    POOL_RATE: float = float(os.getenv("POOL_RATE", "0"))
+    POOL_TIMEOUT: float = float(os.getenv("POOL_TIMEOUT", "30"))
+    FORGE_INSTANCES: str = os.getenv("FORGE_INSTANCES", "").strip()
+    # seconds between checks of the in-memory tracking index against the database
+    INDEX_RECONCILE: int = int(os.getenv("INDEX_RECONCILE", "3600"))
+    # fast lane for new subscriptions
+    FAST_LANE_TIMEOUT: float = float(os.getenv("FAST_LANE_TIMEOUT", "10"))
+    FAST_LANE_CONCURRENCY: int = int(os.getenv("FAST_LANE_CONCURRENCY", "4"))
+    # unavailable repositories: max backoff in seconds and failures before going dormant
+    BACKOFF_MAX: int = int(os.getenv("BACKOFF_MAX", "86400"))
+    DORMANT_AFTER: int = int(os.getenv("DORMANT_AFTER", "6"))
+    # seconds before endpoints known to be empty are probed again
+    CAPABILITY_REPROBE: int = int(os.getenv("CAPABILITY_REPROBE", "86400"))
+    # command throttling: tokens per second and burst per chat, "command=rate/burst,..." overrides
+    THROTTLE_RATE: float = float(os.getenv("THROTTLE_RATE", "1"))
+    THROTTLE_BURST: int = int(os.getenv("THROTTLE_BURST", "5"))
+    THROTTLE_LIMITS: str = os.getenv(
+        "THROTTLE_LIMITS", "list=0.2/3,del=0.2/3,delete=1/5,find=0.5/3,inline=2/10"
+    )
+    # notification outbox
+    OUTBOX_BATCH: int = int(os.getenv("OUTBOX_BATCH", "30"))
+    OUTBOX_INTERVAL: int = int(os.getenv("OUTBOX_INTERVAL", "5"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+    OUTBOX_RETENTION_DAYS: int = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+    # digest
+    DIGEST_INTERVAL: int = int(os.getenv("DIGEST_INTERVAL", "60"))
     # database
     DB_DSN: str = os.getenv("DB_DSN", "data/watcher.db")
     # logging
@@ -17,6 +45,11 @@ class Configuration:
     LOG_FILE: str = os.getenv("LOG_FILE", "bot.log")
     LOG_RETENTION_DAYS: int = int(os.getenv("LOG_RETENTION_DAYS", "7"))
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    # debug surface
+    DEBUG_SURFACE: bool = os.getenv("DEBUG_SURFACE", "").lower() in ("1", "true", "yes")
+    DEBUG_TOKEN: str = os.getenv("DEBUG_TOKEN", "")
+    DEBUG_SLOW_CALLBACK: float = float(os.getenv("DEBUG_SLOW_CALLBACK", "0.1"))
+    DEBUG_PROFILE_SECONDS: float = float(os.getenv("DEBUG_PROFILE_SECONDS", "10"))
 
 
 config = Configuration()
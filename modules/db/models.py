@@ -1,21 +1,41 @@
-from sqlalchemy import BigInteger, String, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import BigInteger, String, ForeignKey, Index, UniqueConstraint, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncAttrs,
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
 from modules.logger import init_logger
 from modules.config import config
 
 logger = init_logger(__name__)
-engine = create_async_engine(url=f"sqlite+aiosqlite:///{config.DB_DSN}")
-if engine:
-    logger.debug(f"Engine created: {engine.url}")
-else:
-    logger.error(
-        f"Failed to create engine. Please check the configuration and restart the application."
-    )
-    SystemExit()
 
-async_session = async_sessionmaker(engine)
+# bump on every schema change, init_db skips the schema setup while it matches
+SCHEMA_VERSION = 3
+
+# created on first use, so importing the models costs nothing
+_engine: AsyncEngine | None = None
+_sessionmaker: async_sessionmaker[AsyncSession] | None = None
+
+
+def get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(url=f"sqlite+aiosqlite:///{config.DB_DSN}")
+        logger.debug(f"Engine created: {_engine.url}")
+    return _engine
+
+
+def async_session() -> AsyncSession:
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = async_sessionmaker(get_engine())
+    return _sessionmaker()
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -38,6 +58,131 @@ class Tracking(Base):
     url: Mapped[str] = mapped_column()
     version: Mapped[str | None] = mapped_column(nullable=True)
 
+
+class DigestSetting(Base):
+    __tablename__ = "digest_settings"
+    chat_id = mapped_column(BigInteger, ForeignKey("chats.chat_id"), primary_key=True)
+    mode: Mapped[str] = mapped_column(String(10), default="immediate")
+    last_sent_at: Mapped[datetime | None] = mapped_column(nullable=True)
+
+
+class PendingRelease(Base):
+    __tablename__ = "pending_releases"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    chat_id = mapped_column(BigInteger, ForeignKey("chats.chat_id"), index=True)
+    tracking_id: Mapped[int] = mapped_column()
+    provider: Mapped[str] = mapped_column(String(10))
+    fullname: Mapped[str] = mapped_column()
+    url: Mapped[str] = mapped_column()
+    version: Mapped[str] = mapped_column()
+    created_at: Mapped[datetime] = mapped_column(default=datetime.now)
+
+
+class RepositoryState(Base):
+    """Failure history of repositories the provider stopped serving."""
+
+    __tablename__ = "repository_states"
+    __table_args__ = (UniqueConstraint("provider", "namespace", "repository"),)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    provider: Mapped[str] = mapped_column(String(10))
+    namespace: Mapped[str] = mapped_column(String(255))
+    repository: Mapped[str] = mapped_column(String(255))
+    failures: Mapped[int] = mapped_column(default=0)
+    last_status: Mapped[int | None] = mapped_column(nullable=True)
+    retry_at: Mapped[datetime | None] = mapped_column(nullable=True)
+    dormant: Mapped[bool] = mapped_column(default=False)
+
+
+class EndpointCapability(Base):
+    """Which provider endpoints serve versions for a repository."""
+
+    __tablename__ = "endpoint_capabilities"
+    __table_args__ = (UniqueConstraint("provider", "namespace", "repository"),)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    provider: Mapped[str] = mapped_column(String(10))
+    namespace: Mapped[str] = mapped_column(String(255))
+    repository: Mapped[str] = mapped_column(String(255))
+    releases: Mapped[bool | None] = mapped_column(nullable=True)
+    tags: Mapped[bool | None] = mapped_column(nullable=True)
+    probed_at: Mapped[datetime | None] = mapped_column(nullable=True)
+
+
+class OutboxMessage(Base):
+    """
+    Notifications written together with the state change that caused them.
+    Delivered rows are deleted, dead ones are purged after OUTBOX_RETENTION_DAYS.
+    """
+
+    __tablename__ = "outbox"
+    # only undelivered rows are polled, so only they are indexed, in polling order
+    __table_args__ = (
+        Index(
+            "ix_outbox_pending",
+            "id",
+            "next_attempt_at",
+            sqlite_where=text("delivered_at IS NULL AND dead = 0"),
+        ),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    chat_id = mapped_column(BigInteger, index=True)
+    text: Mapped[str] = mapped_column()
+    created_at: Mapped[datetime] = mapped_column(default=datetime.now)
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(default=datetime.now)
+    delivered_at: Mapped[datetime | None] = mapped_column(nullable=True)
+    dead: Mapped[bool] = mapped_column(default=False)
+
+
+# full-text index over trackings (external content, synced by modules.db.requests).
+# The chat column holds a delimited chat id, so a search only matches the chat's rows
+# before anything is ranked; URLs are left out, their scheme and host match everything.
+TRACKINGS_FTS = "trackings_fts"
+TRACKINGS_FTS_CONTENT = "trackings_search"
+TRACKINGS_FTS_VIEW_DDL = text(
+    f"CREATE VIEW IF NOT EXISTS {TRACKINGS_FTS_CONTENT} AS "
+    "SELECT id, '#' || chat_id || '#' AS chat, fullname, provider "
+    f"FROM {Tracking.__tablename__}"
+)
+TRACKINGS_FTS_DDL = text(
+    f"CREATE VIRTUAL TABLE {TRACKINGS_FTS} USING fts5("
+    "chat, fullname, provider, "
+    f"content='{TRACKINGS_FTS_CONTENT}', content_rowid='id', tokenize='trigram')"
+)
+
+
+def fts_chat(chat_id: int) -> str:
+    return f"#{chat_id}#"
+
+
+def create_indexes(connection):
+    """
+    create_all only indexes new tables, indexes added to existing ones are created here.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def init_db():
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
+        version = await conn.scalar(text("PRAGMA user_version"))
+        if version == SCHEMA_VERSION:
+            logger.debug(f"Database schema is up to date (version {version}).")
+            return
+
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_indexes)
+        # replaced by the partial ix_outbox_pending index
+        await conn.execute(text("DROP INDEX IF EXISTS ix_outbox_next_attempt_at"))
+
+        # the search index is rebuilt on every schema change, it may predate its columns
+        await conn.execute(text(f"DROP TABLE IF EXISTS {TRACKINGS_FTS}"))
+        await conn.execute(TRACKINGS_FTS_VIEW_DDL)
+        await conn.execute(TRACKINGS_FTS_DDL)
+        await conn.execute(
+            text(f"INSERT INTO {TRACKINGS_FTS}({TRACKINGS_FTS}) VALUES ('rebuild')")
+        )
+        logger.info(f"Search index {TRACKINGS_FTS} has been built.")
+
+        await conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+        logger.info(f"Database schema updated from version {version} to {SCHEMA_VERSION}.")
@@ -1,11 +1,66 @@
-from sqlalchemy import select, delete, update
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import select, delete, update, text, inspect
 
 from modules.logger import init_logger
 from modules.db.models import async_session
-from modules.db.models import Chat, Tracking
+from modules.db.models import Base, Chat, Tracking, TRACKINGS_FTS, fts_chat
+from modules.db.models import DigestSetting, PendingRelease, RepositoryState
+from modules.db.models import EndpointCapability, OutboxMessage
 
 logger = init_logger(__name__)
 
+# search index statements
+FTS_INSERT = text(
+    f"INSERT INTO {TRACKINGS_FTS}(rowid, chat, fullname, provider) "
+    "VALUES (:id, :chat, :fullname, :provider)"
+)
+FTS_DELETE = text(
+    f"INSERT INTO {TRACKINGS_FTS}({TRACKINGS_FTS}, rowid, chat, fullname, provider) "
+    "VALUES ('delete', :id, :chat, :fullname, :provider)"
+)
+FTS_SEARCH = text(
+    f"SELECT {Tracking.__tablename__}.* FROM {TRACKINGS_FTS} "
+    f"JOIN {Tracking.__tablename__} ON {Tracking.__tablename__}.id = {TRACKINGS_FTS}.rowid "
+    f"WHERE {TRACKINGS_FTS} MATCH :query AND {Tracking.__tablename__}.chat_id = :chat_id "
+    f"ORDER BY {TRACKINGS_FTS}.rank LIMIT :limit OFFSET :offset"
+)
+
+
+# callbacks told about committed changes of trackings, digest settings, repository
+# states and endpoint capabilities, called as listener(row, removed)
+_listeners: list[Callable[[Base, bool], None]] = []
+
+
+def on_change(listener: Callable[[Base, bool], None]):
+    """
+    Registers a callback for rows of the tracker's tables that were saved or removed.
+    """
+    _listeners.append(listener)
+
+
+def row_changed(row: Base, removed: bool = False):
+    for listener in _listeners:
+        listener(row, removed)
+
+
+def detached(row: Base) -> Base:
+    """
+    Copy of a row that stays readable once its session is committed and closed.
+    """
+    columns = inspect(row).mapper.column_attrs
+    return type(row)(**{column.key: getattr(row, column.key) for column in columns})
+
+
+def fts_params(track: Tracking) -> dict:
+    return {
+        "id": track.id,
+        "chat": fts_chat(track.chat_id),
+        "fullname": track.fullname,
+        "provider": track.provider,
+    }
+
 
 # chats table
 async def add_chat(chat_id: int):
@@ -58,17 +113,20 @@ async def add_tracking(
         )
 
         if not tracking:
-            session.add(
-                Tracking(
-                    chat_id=chat_id,
-                    provider=provider,
-                    namespace=namespace,
-                    repository=repository,
-                    fullname=fullname,
-                    url=url,
-                )
+            tracking = Tracking(
+                chat_id=chat_id,
+                provider=provider,
+                namespace=namespace,
+                repository=repository,
+                fullname=fullname,
+                url=url,
             )
+            session.add(tracking)
+            await session.flush()
+            await session.execute(FTS_INSERT, fts_params(tracking))
+            saved = detached(tracking)
             await session.commit()
+            row_changed(saved)
             logger.debug(
                 f"Table {Tracking.__tablename__}: New record has been added to the database."
             )
@@ -82,8 +140,11 @@ async def del_tracking(track_id: int):
     async with async_session() as session:
         track = await session.scalar(select(Tracking).where(Tracking.id == track_id))
         if track:
+            await session.execute(FTS_DELETE, fts_params(track))
             await session.execute(delete(Tracking).where(Tracking.id == track.id))
+            removed = detached(track)
             await session.commit()
+            row_changed(removed, removed=True)
             logger.debug(
                 f"Table {Tracking.__tablename__}: Record has been removed from the database."
             )
@@ -131,6 +192,22 @@ async def get_all_trackings():
             return None
 
 
+async def search_trackings(chat_id: int, query: str, limit: int = 10, offset: int = 0):
+    """
+    Ranked substring search over the chat's trackings using the trigram index.
+    The trigram tokenizer needs at least 3 characters to match anything.
+    """
+    phrase = '"' + query.replace('"', '""') + '"'
+    # the chat filter is part of the match, other chats' rows are never ranked
+    query = f'chat : "{fts_chat(chat_id)}" AND {{fullname provider}} : {phrase}'
+    async with async_session() as session:
+        tracks = await session.scalars(
+            select(Tracking).from_statement(FTS_SEARCH),
+            {"query": query, "chat_id": chat_id, "limit": limit, "offset": offset},
+        )
+        return tracks.all()
+
+
 # version update
 async def update_tracking_version(track_id: int, version: str):
     async with async_session() as session:
@@ -138,3 +215,375 @@ async def update_tracking_version(track_id: int, version: str):
             update(Tracking).where(Tracking.id == track_id).values(version=version)
         )
         await session.commit()
+
+
+async def rename_repository(
+    provider: str,
+    namespace: str,
+    repository: str,
+    new_namespace: str,
+    new_repository: str,
+    url: str,
+):
+    """
+    Rewrites all subscriptions of a repository that was moved by its provider.
+    Chats that already follow the new location simply lose the stale entry.
+    The repository state and endpoint capabilities move along with them.
+    """
+    fullname = f"{new_namespace}/{new_repository}"
+    changes = []
+    async with async_session() as session:
+        tracks = await session.scalars(
+            select(Tracking).where(
+                (Tracking.provider == provider)
+                & (Tracking.namespace == namespace)
+                & (Tracking.repository == repository)
+            )
+        )
+        for track in tracks.all():
+            await session.execute(FTS_DELETE, fts_params(track))
+            duplicate = await session.scalar(
+                select(Tracking.id).where(
+                    (Tracking.chat_id == track.chat_id)
+                    & (Tracking.provider == provider)
+                    & (Tracking.fullname == fullname)
+                )
+            )
+            if duplicate:
+                changes.append((detached(track), True))
+                await session.delete(track)
+                continue
+            track.namespace = new_namespace
+            track.repository = new_repository
+            track.fullname = fullname
+            track.url = url
+            await session.execute(FTS_INSERT, fts_params(track))
+            changes.append((detached(track), False))
+
+        for model in (RepositoryState, EndpointCapability):
+            row = await session.scalar(
+                select(model).where(
+                    (model.provider == provider)
+                    & (model.namespace == namespace)
+                    & (model.repository == repository)
+                )
+            )
+            if not row:
+                continue
+            changes.append((detached(row), True))
+            # rows already kept for the new location win
+            await session.execute(
+                delete(model).where(
+                    (model.provider == provider)
+                    & (model.namespace == new_namespace)
+                    & (model.repository == new_repository)
+                )
+            )
+            row.namespace = new_namespace
+            row.repository = new_repository
+            changes.append((detached(row), False))
+        await session.commit()
+        for track, removed in changes:
+            row_changed(track, removed)
+        logger.debug(
+            f"Table {Tracking.__tablename__}: {provider} {namespace}/{repository} renamed to {fullname}."
+        )
+
+
+async def set_baseline_version(
+    provider: str, namespace: str, repository: str, version: str
+):
+    """
+    Sets the first known version for subscriptions that have none yet.
+    """
+    async with async_session() as session:
+        await session.execute(
+            update(Tracking)
+            .where(
+                (Tracking.provider == provider)
+                & (Tracking.namespace == namespace)
+                & (Tracking.repository == repository)
+                & Tracking.version.is_(None)
+            )
+            .values(version=version)
+        )
+        await session.commit()
+
+
+# repository states table
+async def get_repository_states() -> dict[tuple[str, str, str], RepositoryState]:
+    async with async_session() as session:
+        states = await session.scalars(select(RepositoryState))
+        return {(s.provider, s.namespace, s.repository): s for s in states}
+
+
+async def record_repository_failure(
+    provider: str,
+    namespace: str,
+    repository: str,
+    status: int | None,
+    retry_at: datetime,
+    dormant: bool,
+) -> RepositoryState:
+    async with async_session() as session:
+        state = await session.scalar(
+            select(RepositoryState).where(
+                (RepositoryState.provider == provider)
+                & (RepositoryState.namespace == namespace)
+                & (RepositoryState.repository == repository)
+            )
+        )
+        if not state:
+            state = RepositoryState(
+                provider=provider, namespace=namespace, repository=repository, failures=0
+            )
+            session.add(state)
+        state.failures += 1
+        state.last_status = status
+        state.retry_at = retry_at
+        state.dormant = dormant
+        await session.flush()
+        state = detached(state)
+        await session.commit()
+        row_changed(state)
+        return state
+
+
+async def clear_repository_state(provider: str, namespace: str, repository: str):
+    async with async_session() as session:
+        await session.execute(
+            delete(RepositoryState).where(
+                (RepositoryState.provider == provider)
+                & (RepositoryState.namespace == namespace)
+                & (RepositoryState.repository == repository)
+            )
+        )
+        await session.commit()
+    row_changed(
+        RepositoryState(provider=provider, namespace=namespace, repository=repository),
+        removed=True,
+    )
+
+
+# endpoint capabilities table
+async def get_endpoint_capabilities() -> (
+    dict[tuple[str, str, str], EndpointCapability]
+):
+    async with async_session() as session:
+        rows = await session.scalars(select(EndpointCapability))
+        return {(c.provider, c.namespace, c.repository): c for c in rows}
+
+
+async def get_endpoint_capability(
+    provider: str, namespace: str, repository: str
+) -> EndpointCapability | None:
+    async with async_session() as session:
+        return await session.scalar(
+            select(EndpointCapability).where(
+                (EndpointCapability.provider == provider)
+                & (EndpointCapability.namespace == namespace)
+                & (EndpointCapability.repository == repository)
+            )
+        )
+
+
+async def save_endpoint_capability(
+    provider: str,
+    namespace: str,
+    repository: str,
+    releases: bool | None,
+    tags: bool | None,
+    probed_at: datetime | None,
+):
+    async with async_session() as session:
+        capability = await session.scalar(
+            select(EndpointCapability).where(
+                (EndpointCapability.provider == provider)
+                & (EndpointCapability.namespace == namespace)
+                & (EndpointCapability.repository == repository)
+            )
+        )
+        if not capability:
+            capability = EndpointCapability(
+                provider=provider, namespace=namespace, repository=repository
+            )
+            session.add(capability)
+        capability.releases = releases
+        capability.tags = tags
+        capability.probed_at = probed_at
+        await session.flush()
+        capability = detached(capability)
+        await session.commit()
+    row_changed(capability)
+
+
+# digest settings table
+async def get_digest_mode(chat_id: int) -> str:
+    async with async_session() as session:
+        setting = await session.get(DigestSetting, chat_id)
+        return setting.mode if setting else "immediate"
+
+
+async def get_digest_modes() -> dict[int, str]:
+    async with async_session() as session:
+        settings = await session.scalars(select(DigestSetting))
+        return {s.chat_id: s.mode for s in settings}
+
+
+async def set_digest_mode(chat_id: int, mode: str):
+    async with async_session() as session:
+        setting = await session.get(DigestSetting, chat_id)
+        if setting:
+            setting.mode = mode
+            setting.last_sent_at = datetime.now()
+        else:
+            setting = DigestSetting(chat_id=chat_id, mode=mode, last_sent_at=datetime.now())
+            session.add(setting)
+        saved = detached(setting)
+        await session.commit()
+    row_changed(saved)
+    logger.debug(f"Table {DigestSetting.__tablename__}: Chat {chat_id} switched to {mode}.")
+
+
+# pending releases table
+async def queue_release(item: Tracking, version: str):
+    """
+    Stores the new version and the pending digest entry in one transaction.
+    """
+    async with async_session() as session:
+        await session.execute(
+            update(Tracking).where(Tracking.id == item.id).values(version=version)
+        )
+        session.add(
+            PendingRelease(
+                chat_id=item.chat_id,
+                tracking_id=item.id,
+                provider=item.provider,
+                fullname=item.fullname,
+                url=item.url,
+                version=version,
+            )
+        )
+        await session.commit()
+
+
+async def get_due_digests(windows: dict[str, int]):
+    """
+    Returns (setting, releases) pairs for the chats whose digest window has passed.
+    """
+    now = datetime.now()
+    due = []
+    async with async_session() as session:
+        settings = await session.scalars(select(DigestSetting))
+        for setting in settings.all():
+            window = windows.get(setting.mode)
+            if window is None:
+                continue
+            if (
+                setting.last_sent_at
+                and (now - setting.last_sent_at).total_seconds() < window
+            ):
+                continue
+            releases = await session.scalars(
+                select(PendingRelease)
+                .where(PendingRelease.chat_id == setting.chat_id)
+                .order_by(PendingRelease.id)
+            )
+            releases = releases.all()
+            if releases:
+                due.append((setting, releases))
+    return due
+
+
+async def enqueue_digest(chat_id: int, release_ids: list[int], pages: list[str]):
+    """
+    Moves the pending releases of a chat into the outbox as digest pages.
+    """
+    async with async_session() as session:
+        session.add_all(OutboxMessage(chat_id=chat_id, text=page) for page in pages)
+        await session.execute(
+            delete(PendingRelease).where(PendingRelease.id.in_(release_ids))
+        )
+        await session.execute(
+            update(DigestSetting)
+            .where(DigestSetting.chat_id == chat_id)
+            .values(last_sent_at=datetime.now())
+        )
+        await session.commit()
+
+
+# outbox table
+async def record_release(track_id: int, version: str, chat_id: int, text: str):
+    """
+    Stores the new version and its notification in one transaction.
+    """
+    async with async_session() as session:
+        await session.execute(
+            update(Tracking).where(Tracking.id == track_id).values(version=version)
+        )
+        session.add(OutboxMessage(chat_id=chat_id, text=text))
+        await session.commit()
+
+
+async def enqueue_messages(chat_ids: list[int], text: str):
+    async with async_session() as session:
+        session.add_all(OutboxMessage(chat_id=chat_id, text=text) for chat_id in chat_ids)
+        await session.commit()
+
+
+async def get_pending_outbox(limit: int):
+    async with async_session() as session:
+        messages = await session.scalars(
+            select(OutboxMessage)
+            .where(
+                OutboxMessage.delivered_at.is_(None)
+                & ~OutboxMessage.dead
+                & (OutboxMessage.next_attempt_at <= datetime.now())
+            )
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+        )
+        return messages.all()
+
+
+async def mark_outbox_delivered(message_ids: list[int]):
+    """
+    Delivered messages are removed, so the table only holds pending and dead ones.
+    """
+    async with async_session() as session:
+        await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(message_ids)))
+        await session.commit()
+
+
+async def purge_outbox(before: datetime) -> int:
+    """
+    Deletes dead messages created before the date, along with delivered ones
+    left by versions that kept them.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            delete(OutboxMessage).where(
+                (OutboxMessage.dead | OutboxMessage.delivered_at.is_not(None))
+                & (OutboxMessage.created_at < before)
+            )
+        )
+        await session.commit()
+        return result.rowcount
+
+
+async def mark_outbox_failed(
+    message_ids: list[int],
+    next_attempt_at: datetime | None,
+    dead: bool,
+    count_attempt: bool = True,
+):
+    values = {"dead": dead}
+    if next_attempt_at:
+        values["next_attempt_at"] = next_attempt_at
+    if count_attempt:
+        values["attempts"] = OutboxMessage.attempts + 1
+    async with async_session() as session:
+        await session.execute(
+            update(OutboxMessage).where(OutboxMessage.id.in_(message_ids)).values(**values)
+        )
+        await session.commit()
@@ -0,0 +1,222 @@
+import asyncio, hmac, io, signal, sys, threading, time
+
+from collections import Counter
+from typing import Callable
+from contextlib import contextmanager, nullcontext
+from aiohttp import web
+
+from modules.config import config
+from modules.logger import init_logger
+
+logger = init_logger(__name__)
+
+# shared no-op context, so disabled stage timing costs a single check
+_NULL_STAGE = nullcontext()
+# stage name -> [count, total seconds, max seconds]
+_stages: dict[str, list] = {}
+# hard cap for on-demand profiles
+PROFILE_MAX_SECONDS = 60
+# one sampling thread at a time
+_profiling = asyncio.Lock()
+# name -> callable returning a text report, served under /debug/<name>
+_reports: dict[str, Callable[[], str]] = {}
+
+
+def register_report(name: str, report: Callable[[], str]):
+    """
+    Publishes a text report of another module on the debug surface.
+    """
+    _reports[name] = report
+
+
+# stage timing
+def stage(name: str):
+    """
+    Times a block of the hot path. Does nothing unless the debug surface is enabled.
+    """
+    if not config.DEBUG_SURFACE:
+        return _NULL_STAGE
+    return _timed_stage(name)
+
+
+@contextmanager
+def _timed_stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _stages.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+
+def stage_report() -> str:
+    if not _stages:
+        return "No stage timings recorded yet."
+    lines = [f"{'stage':<16} {'count':>8} {'total, s':>10} {'avg, ms':>9} {'max, ms':>9}"]
+    for name, (count, total, peak) in sorted(
+        _stages.items(), key=lambda s: s[1][1], reverse=True
+    ):
+        lines.append(
+            f"{name:<16} {count:>8} {total:>10.3f} {total / count * 1000:>9.2f} {peak * 1000:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+# event loop inspection
+def setup_debug_loop():
+    """
+    Enables slow callback detection with the configured threshold.
+    asyncio debug mode is avoided on purpose: it captures a traceback for every
+    scheduled handle, which would dominate the profiles taken here.
+    """
+    if not config.DEBUG_SURFACE or getattr(asyncio.Handle._run, "_timed", False):
+        return
+
+    run = asyncio.Handle._run
+    threshold = config.DEBUG_SLOW_CALLBACK
+
+    def timed_run(handle):
+        started = time.perf_counter()
+        run(handle)
+        elapsed = time.perf_counter() - started
+        if elapsed >= threshold:
+            # task steps are wrapped, the task itself tells much more than the wrapper
+            source = getattr(handle._callback, "__self__", None) or handle
+            logger.warning(f"Slow callback took {elapsed:.3f} seconds: {source!r}")
+
+    timed_run._timed = True  # type: ignore
+    asyncio.Handle._run = timed_run  # type: ignore
+    logger.warning(f"Debug surface enabled, slow callback threshold {threshold} seconds.")
+
+
+def dump_tasks() -> str:
+    """
+    Returns all live tasks with their stacks.
+    """
+    buffer = io.StringIO()
+    tasks = asyncio.all_tasks()
+    buffer.write(f"{len(tasks)} live tasks\n")
+    for task in sorted(tasks, key=lambda t: t.get_name()):
+        buffer.write(f"\n--- {task.get_name()}: {task.get_coro()!r}\n")
+        task.print_stack(file=buffer)
+    return buffer.getvalue()
+
+
+def _sample(thread_id: int, seconds: float, interval: float) -> Counter:
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        if stack:
+            samples[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return samples
+
+
+async def sample_profile(seconds: float, interval: float = 0.005, top: int = 25) -> str:
+    """
+    Samples the event loop thread stacks for the given time and returns the hottest ones.
+    """
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    samples = await asyncio.to_thread(_sample, threading.get_ident(), seconds, interval)
+    total = sum(samples.values()) or 1
+
+    leaves = Counter()
+    for stack, count in samples.items():
+        leaves[stack[-1]] += count
+
+    lines = [f"{total} samples over {seconds} seconds", "", "Hottest frames:"]
+    for frame, count in leaves.most_common(top):
+        lines.append(f"{count / total:>7.1%}  {frame}")
+    lines += ["", "Hottest stacks:"]
+    for stack, count in samples.most_common(top):
+        lines.append(f"{count / total:>7.1%}  " + " <- ".join(reversed(stack[-6:])))
+    return "\n".join(lines)
+
+
+# aiohttp routes
+def _authorized(request: web.Request) -> bool:
+    token = request.headers.get("X-Debug-Token") or request.query.get("token") or ""
+    return hmac.compare_digest(token.encode(), config.DEBUG_TOKEN.encode())
+
+
+async def tasks_handler(request: web.Request) -> web.Response:
+    if not _authorized(request):
+        raise web.HTTPForbidden()
+    return web.Response(text=dump_tasks())
+
+
+async def stages_handler(request: web.Request) -> web.Response:
+    if not _authorized(request):
+        raise web.HTTPForbidden()
+    return web.Response(text=stage_report())
+
+
+async def report_handler(request: web.Request) -> web.Response:
+    if not _authorized(request):
+        raise web.HTTPForbidden()
+    return web.Response(text=_reports[request.match_info["name"]]())
+
+
+async def profile_handler(request: web.Request) -> web.Response:
+    if not _authorized(request):
+        raise web.HTTPForbidden()
+    try:
+        seconds = float(request.query.get("seconds", config.DEBUG_PROFILE_SECONDS))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds must be a number")
+    if _profiling.locked():
+        raise web.HTTPTooManyRequests(text="A profile is already being taken.")
+    async with _profiling:
+        return web.Response(text=await sample_profile(seconds))
+
+
+def setup_debug_routes(app: web.Application):
+    """
+    Registers the /debug endpoints when the debug surface is enabled.
+    They share the public webhook listener, so they are never served without a token.
+    """
+    if not config.DEBUG_SURFACE:
+        return
+    if not config.DEBUG_TOKEN:
+        logger.error("DEBUG_TOKEN is not set, debug endpoints are not registered.")
+        return
+    app.router.add_get("/debug/tasks", tasks_handler)
+    app.router.add_get("/debug/stages", stages_handler)
+    app.router.add_get("/debug/profile", profile_handler)
+    for name in _reports:
+        app.router.add_get(f"/debug/{{name:{name}}}", report_handler)
+    logger.info("Debug endpoints registered under /debug.")
+
+
+# polling mode signals
+def _log_state():
+    reports = "".join(f"\n{name}:\n{report()}" for name, report in _reports.items())
+    logger.info(f"Tasks:\n{dump_tasks()}\nStages:\n{stage_report()}{reports}")
+
+
+async def _log_profile():
+    if _profiling.locked():
+        logger.warning("A profile is already being taken.")
+        return
+    async with _profiling:
+        logger.info(f"Profile:\n{await sample_profile(config.DEBUG_PROFILE_SECONDS)}")
+
+
+def setup_debug_signals(loop: asyncio.AbstractEventLoop):
+    """
+    SIGUSR1 logs live tasks and stage timings, SIGUSR2 logs a sampling profile.
+    """
+    if not config.DEBUG_SURFACE or not hasattr(signal, "SIGUSR1"):
+        return
+    loop.add_signal_handler(signal.SIGUSR1, _log_state)
+    loop.add_signal_handler(signal.SIGUSR2, lambda: asyncio.create_task(_log_profile()))
+    logger.info("Debug signal handlers installed (SIGUSR1, SIGUSR2).")
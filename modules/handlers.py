@@ -1,15 +1,36 @@
 from aiogram import Bot, Router, html, F
-from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from aiogram.fsm.context import FSMContext
 
 import modules.keyboards as kb
 from modules.states import MenuStates
 from modules.providers import Provider
-from modules.db.requests import add_chat, add_tracking, del_tracking, get_chat_trackings
+from modules.db.requests import (
+    add_chat,
+    add_tracking,
+    del_tracking,
+    get_chat_trackings,
+    search_trackings,
+    get_digest_mode,
+    set_digest_mode,
+)
+from modules.tracking import DIGEST_WINDOWS, request_baseline
 from modules.logger import init_logger
+from modules.middlewares import throttling
+from modules.debug import register_report
 
 router = Router()
+router.message.middleware(throttling)
+router.callback_query.middleware(throttling)
+router.inline_query.middleware(throttling)
+register_report("throttling", throttling.report)
 
 logger = init_logger(__name__)
 
@@ -58,6 +79,8 @@ The following providers are currently supported:
     - {html.italic('GitHub')}
     - {html.italic('GitLab')}
     - {html.italic('Docker Hub')}
+    - {html.italic('GHCR')} and {html.italic('Quay')} container registries
+    - {html.italic('self-hosted GitLab, Gitea, Forgejo and OCI registries')} configured by the administrator
     
 To control the bot, use the menu or commands.
 
@@ -66,6 +89,8 @@ To control the bot, use the menu or commands.
 /menu — return to menu
 /repos — go to the repository actions menu
 /list — view the list of monitored repositories
+/find — search the monitored repositories
+/digest — choose how often notifications are delivered
 /add — add a repository to monitor
 /del — remove a repository from monitored lists
 /help — view help
@@ -97,7 +122,7 @@ Information about the bot.
 async def command_repo_add_handler(message: Message, state: FSMContext):
     await state.set_state(MenuStates.track_add)
     await message.answer(
-        f'Please provide a link to your {html.bold("GitHub")}, {html.bold("GitLab")} or {html.bold("Docker Hub")} repository.',
+        f'Please provide a link to your {html.bold("GitHub")}, {html.bold("GitLab")}, {html.bold("Docker Hub")}, {html.bold("GHCR")} or {html.bold("Quay")} repository.',
         reply_markup=await kb.menu_return(),
     )
 
@@ -119,8 +144,10 @@ async def state_repo_add_handler(message: Message, state: FSMContext):
         await add_tracking(
             message.chat.id, provider, namespace, repository, fullname, url
         )
+        version = await request_baseline(provider, namespace, repository)
+        current = f"\nCurrent version: {html.bold(version)}" if version else ""
         await message.answer(
-            f"✅ Subscription added!\n{provider}: {fullname}",
+            f"✅ Subscription added!\n{provider}: {fullname}{current}",
             reply_markup=await kb.menu_return(),
         )
     else:
@@ -203,6 +230,117 @@ async def command_repo_list_handler(message: Message, state: FSMContext):
     await message.answer(f"What do you want to do?", reply_markup=await kb.menu_repos())
 
 
+# search in tracked repos
+FIND_PAGE_SIZE = 10
+FIND_MIN_LENGTH = 3
+
+
+@router.message(Command("find"))
+async def command_repo_find_handler(
+    message: Message, command: CommandObject, state: FSMContext
+):
+    query = (command.args or "").strip()
+    if len(query) < FIND_MIN_LENGTH:
+        await message.answer(
+            f"🔎 Usage: /find <text>. At least {FIND_MIN_LENGTH} characters are needed."
+        )
+        return
+
+    await state.update_data(find_query=query)
+    trackings = await search_trackings(
+        message.chat.id, query, limit=FIND_PAGE_SIZE + 1
+    )
+    list = await kb.menu_find_results(trackings, 0, FIND_PAGE_SIZE)
+
+    if list is None:
+        await message.answer(f"🔎 Nothing found for {html.quote(query)}.")
+        return
+
+    await message.answer(f"🔎 Results for {html.quote(query)}:", reply_markup=list)
+
+
+@router.callback_query(F.data.startswith("find_"))
+async def repo_find_callback_handler(callback: CallbackQuery, state: FSMContext):
+    offset = int(callback.data.split("_")[1])
+    query = (await state.get_data()).get("find_query")
+    if not query:
+        await callback.answer("Search has expired, please run /find again.")
+        return
+
+    trackings = await search_trackings(
+        callback.message.chat.id, query, limit=FIND_PAGE_SIZE + 1, offset=offset
+    )
+    list = await kb.menu_find_results(trackings, offset, FIND_PAGE_SIZE)
+    await callback.answer()
+    if list is None:
+        await callback.message.edit_text(f"🔎 Nothing found for {html.quote(query)}.")
+        return
+    await callback.message.edit_text(
+        f"🔎 Results for {html.quote(query)}:", reply_markup=list
+    )
+
+
+@router.inline_query()
+async def inline_find_handler(inline_query: InlineQuery):
+    """
+    Inline search over the repositories tracked in the private chat with the user.
+    """
+    query = inline_query.query.strip()
+    offset = int(inline_query.offset or 0)
+    if len(query) < FIND_MIN_LENGTH:
+        await inline_query.answer([], is_personal=True, cache_time=5)
+        return
+
+    trackings = await search_trackings(
+        inline_query.from_user.id, query, limit=FIND_PAGE_SIZE + 1, offset=offset
+    )
+    results = [
+        InlineQueryResultArticle(
+            id=str(item.id),
+            title=f"{item.provider}: {item.fullname}",
+            description=f"Version: {item.version or 'unknown'}",
+            url=item.url,
+            input_message_content=InputTextMessageContent(
+                message_text=f"{html.link(item.fullname, item.url)}\n"
+                f"Version: {item.version or 'unknown'}",
+            ),
+        )
+        for item in trackings[:FIND_PAGE_SIZE]
+    ]
+    next_offset = (
+        str(offset + FIND_PAGE_SIZE) if len(trackings) > FIND_PAGE_SIZE else ""
+    )
+    await inline_query.answer(
+        results, is_personal=True, cache_time=5, next_offset=next_offset
+    )
+
+
+# digest delivery mode
+@router.message(Command("digest"))
+async def command_digest_handler(message: Message):
+    mode = await get_digest_mode(message.chat.id)
+    await message.answer(
+        "📬 How should release notifications be delivered?\n"
+        "Hourly and daily modes group all new releases into one message.",
+        reply_markup=await kb.menu_digest(mode, DIGEST_WINDOWS),
+    )
+
+
+@router.callback_query(F.data.startswith("digest_"))
+async def digest_callback_handler(callback: CallbackQuery):
+    mode = callback.data.split("_")[1]
+    if mode not in DIGEST_WINDOWS:
+        await callback.answer()
+        return
+
+    await add_chat(callback.message.chat.id)
+    await set_digest_mode(callback.message.chat.id, mode)
+    await callback.answer(f"✅ Delivery mode: {mode}")
+    await callback.message.edit_reply_markup(
+        reply_markup=await kb.menu_digest(mode, DIGEST_WINDOWS)
+    )
+
+
 # menu
 @router.message(Command("menu"))
 @router.message(F.text == "🏠 Menu")
@@ -0,0 +1,246 @@
+import asyncio, time
+
+from collections import Counter
+from typing import Awaitable, Callable
+
+from modules.config import config
+from modules.db.models import Base, Tracking, DigestSetting
+from modules.db.models import RepositoryState, EndpointCapability
+from modules.db.requests import (
+    get_all_trackings,
+    get_digest_modes,
+    get_repository_states,
+    get_endpoint_capabilities,
+    on_change,
+)
+from modules.debug import register_report, stage
+from modules.logger import init_logger
+
+logger = init_logger(__name__)
+
+RepositoryKey = tuple[str, str, str]
+
+
+class TrackingIndex:
+    """
+    In-memory copy of the trackings table grouped by repository, the tracker's
+    source of truth, along with digest modes, repository states and endpoint
+    capabilities. It is loaded once, kept current by the change hook of the
+    database requests, and version changes are written back in the background.
+    """
+
+    def __init__(self):
+        self.repositories: dict[RepositoryKey, dict[int, Tracking]] = {}
+        self.keys: dict[int, RepositoryKey] = {}
+        self.modes: dict[int, str] = {}
+        self.states: dict[RepositoryKey, RepositoryState] = {}
+        self.capabilities: dict[RepositoryKey, EndpointCapability] = {}
+        self.loaded = False
+        # changes committed while the tables are read, applied after the rebuild
+        self._loading = False
+        self._changes: list[tuple[Base, bool]] = []
+        self.reconciled_at = 0.0
+        self.stats: Counter = Counter()
+        self._writes: asyncio.Queue[tuple[set[int], Callable[[], Awaitable]]] = (
+            asyncio.Queue()
+        )
+        # trackings written while a reconcile reads the table keep their memory version
+        self._touched: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def key(row) -> RepositoryKey:
+        return row.provider, row.namespace, row.repository
+
+    def _insert(self, track: Tracking):
+        key = self.key(track)
+        self.repositories.setdefault(key, {})[track.id] = track
+        self.keys[track.id] = key
+
+    def _discard(self, track_id: int):
+        key = self.keys.pop(track_id, None)
+        subscribers = self.repositories.get(key)
+        if subscribers is None:
+            return
+        subscribers.pop(track_id, None)
+        if not subscribers:
+            del self.repositories[key]
+
+    def apply(self, row: Base, removed: bool = False):
+        """
+        Change hook of the database requests: saves or drops one row in memory.
+        """
+        if self._loading:
+            self._changes.append((row, removed))
+            return
+        if not self.loaded:
+            return
+
+        if isinstance(row, Tracking):
+            self._apply_tracking(row, removed)
+        elif isinstance(row, DigestSetting):
+            self.modes[row.chat_id] = row.mode
+        elif isinstance(row, RepositoryState):
+            if removed:
+                self.states.pop(self.key(row), None)
+            else:
+                self.states[self.key(row)] = row
+        elif isinstance(row, EndpointCapability):
+            if removed:
+                self.capabilities.pop(self.key(row), None)
+            else:
+                self.capabilities[self.key(row)] = row
+
+    def _apply_tracking(self, track: Tracking, removed: bool):
+        """
+        Known trackings are updated in place, the tracker may be holding them.
+        """
+        if removed:
+            self._discard(track.id)
+            return
+
+        current = self.repositories.get(self.keys.get(track.id), {}).get(track.id)
+        if current is None:
+            self._insert(track)
+            return
+        if self.key(track) != self.key(current):
+            self._discard(track.id)
+            current.namespace, current.repository = track.namespace, track.repository
+            current.fullname, current.url = track.fullname, track.url
+            self._insert(current)
+
+    def snapshot(self) -> list[list[Tracking]]:
+        """
+        Subscribers of every repository, safe to walk while the index changes.
+        """
+        return [list(subscribers.values()) for subscribers in self.repositories.values()]
+
+    def subscribers(self, key: RepositoryKey) -> list[Tracking]:
+        return list(self.repositories.get(key, {}).values())
+
+    async def load(self) -> set[int]:
+        """
+        Reads the tables and rebuilds the index. Changes committed during the read
+        are applied on top, so none of them is lost to the rebuild.
+        Returns the ids of the trackings those changes touched.
+        """
+        self._loading = True
+        try:
+            with stage("index load"):
+                trackings = await get_all_trackings() or []
+                modes = await get_digest_modes()
+                states = await get_repository_states()
+                capabilities = await get_endpoint_capabilities()
+        except BaseException:
+            self._replay_changes()
+            raise
+
+        self.repositories, self.keys = {}, {}
+        for track in trackings:
+            self._insert(track)
+        self.modes, self.states, self.capabilities = modes, states, capabilities
+        self.loaded = True
+        self.reconciled_at = time.monotonic()
+        changed = self._replay_changes()
+        logger.info(
+            f"Tracking index loaded: {len(self)} trackings of {len(self.repositories)} repositories."
+        )
+        return changed
+
+    def _replay_changes(self) -> set[int]:
+        self._loading = False
+        changes, self._changes = self._changes, []
+        for row, removed in changes:
+            self.apply(row, removed)
+        return {row.id for row, _ in changes if isinstance(row, Tracking)}
+
+    def reconcile_due(self) -> bool:
+        return time.monotonic() - self.reconciled_at >= config.INDEX_RECONCILE
+
+    async def reconcile(self):
+        """
+        Reloads the index from the database once pending writes are stored.
+        Trackings written meanwhile keep their version from memory.
+        """
+        await self._writes.join()
+        self._touched.clear()
+        # the old objects, written behind during the load, hold the newest versions
+        previous = {
+            track_id: track
+            for subscribers in self.repositories.values()
+            for track_id, track in subscribers.items()
+        }
+        versions = {track_id: track.version for track_id, track in previous.items()}
+        changed = await self.load()
+
+        drift = 0
+        for track_id in previous.keys() | self.keys.keys():
+            track = self.repositories.get(self.keys.get(track_id), {}).get(track_id)
+            if track and track_id in previous and track_id in self._touched:
+                track.version = previous[track_id].version
+            elif track_id in changed:
+                # added, moved or removed during the load, not a difference
+                continue
+            elif track is None or track_id not in previous:
+                drift += 1
+            elif track.version != versions[track_id]:
+                drift += 1
+        self._touched.clear()
+
+        self.stats["reconciles"] += 1
+        self.stats["drift"] += drift
+        if drift:
+            logger.warning(f"Tracking index reconciled, {drift} tracking(s) differed.")
+
+    def write_behind(
+        self, tracks: list[Tracking], version: str, write: Callable[[], Awaitable]
+    ):
+        """
+        Sets the version in memory right away and queues the database write.
+        """
+        for track in tracks:
+            track.version = version
+        track_ids = {track.id for track in tracks}
+        self._touched |= track_ids
+        self._writes.put_nowait((track_ids, write))
+        self.stats["queued"] += 1
+
+    async def _write(self, track_ids: set[int], write: Callable[[], Awaitable]):
+        try:
+            with stage("db write"):
+                await write()
+            self.stats["written"] += 1
+        except Exception as e:
+            # the database keeps the old version, the next reconcile picks it up again
+            self.stats["failed"] += 1
+            logger.exception(f"Failed to write back trackings {sorted(track_ids)}: {e}")
+        finally:
+            self._writes.task_done()
+
+    async def run_writer(self):
+        """
+        Stores queued version changes in order, flushing what is left on shutdown.
+        """
+        try:
+            while True:
+                await self._write(*await self._writes.get())
+        finally:
+            while not self._writes.empty():
+                await self._write(*self._writes.get_nowait())
+
+    def report(self) -> str:
+        lines = [
+            f"trackings: {len(self)}, repositories: {len(self.repositories)}",
+            f"pending writes: {self._writes.qsize()}",
+            f"last reconcile: {time.monotonic() - self.reconciled_at:.0f} seconds ago",
+            "",
+            *(f"{name:<12} {count:>10}" for name, count in sorted(self.stats.items())),
+        ]
+        return "\n".join(lines)
+
+
+index = TrackingIndex()
+on_change(index.apply)
+register_report("index", index.report)
@@ -74,3 +74,36 @@ async def menu_repos_list(trackings, mode: str = "view") -> InlineKeyboardMarkup
                 callback_data=f"view_{item.id}",
             )
     return kb.adjust(1).as_markup()  # type: ignore
+
+
+# search results inline keyboard with pagination
+async def menu_find_results(
+    trackings, offset: int, limit: int
+) -> InlineKeyboardMarkup | None:
+    if not trackings:
+        return None
+
+    kb = InlineKeyboardBuilder()
+    for item in trackings[:limit]:
+        kb.button(text=f"{item.provider}: {item.fullname}", url=item.url)
+
+    nav = []
+    if offset > 0:
+        kb.button(text="⬅️ Back", callback_data=f"find_{max(offset - limit, 0)}")
+        nav.append(1)
+    if len(trackings) > limit:
+        kb.button(text="Next ➡️", callback_data=f"find_{offset + limit}")
+        nav.append(1)
+    sizes = [1] * min(len(trackings), limit)
+    if nav:
+        sizes.append(len(nav))
+    return kb.adjust(*sizes).as_markup()  # type: ignore
+
+
+# digest delivery mode inline keyboard
+async def menu_digest(current: str, modes) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for mode in modes:
+        mark = "✅ " if mode == current else ""
+        kb.button(text=f"{mark}{mode.capitalize()}", callback_data=f"digest_{mode}")
+    return kb.adjust(len(modes)).as_markup()  # type: ignore
@@ -4,22 +4,25 @@ from pathlib import Path
 
 from modules.config import config
 
+# shared by all loggers, created by the first init_logger call
+_handlers: list[logging.Handler] = []
 
-def init_logger(name: str | None = None) -> logging.Logger:
 
-    # log file configuration
-    log_dir = Path(config.LOG_DIR)
-    log_dir.mkdir(parents=True, exist_ok=True)
-    log_file = log_dir / config.LOG_FILE
+class LazyFileHandler(TimedRotatingFileHandler):
+    """Creates the log directory and opens the file only when the first record is written."""
 
-    # logger init
-    if name:
-        logger = logging.getLogger(name)
-    else:
-        logger = logging.getLogger()
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
 
-    # level
-    log_level = getattr(logging, config.LOG_LEVEL, logging.INFO)
+
+def get_handlers() -> list[logging.Handler]:
+
+    if _handlers:
+        return _handlers
+
+    # log file configuration
+    log_file = Path(config.LOG_DIR) / config.LOG_FILE
 
     # formatter
     log_formatter = logging.Formatter(
@@ -28,25 +31,41 @@ def init_logger(name: str | None = None) -> logging.Logger:
     )
 
     # handlers
-    file_handler = TimedRotatingFileHandler(
+    file_handler = LazyFileHandler(
         log_file,
         when="midnight",
         backupCount=config.LOG_RETENTION_DAYS,
         encoding="UTF-8",
+        delay=True,
     )
 
     console_handler = logging.StreamHandler()
 
     file_handler.setFormatter(log_formatter)
     console_handler.setFormatter(log_formatter)
-    logger.handlers.clear()
-
-    # apply logger configuration
-    logger.setLevel(log_level)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    _handlers.extend((file_handler, console_handler))
 
     # reducing aiogram noise
     logging.getLogger("aiogram").setLevel(logging.WARNING)
 
+    return _handlers
+
+
+def init_logger(name: str | None = None) -> logging.Logger:
+
+    # logger init
+    if name:
+        logger = logging.getLogger(name)
+    else:
+        logger = logging.getLogger()
+
+    # level
+    log_level = getattr(logging, config.LOG_LEVEL, logging.INFO)
+
+    # apply logger configuration
+    logger.handlers.clear()
+    logger.setLevel(log_level)
+    for handler in get_handlers():
+        logger.addHandler(handler)
+
     return logger
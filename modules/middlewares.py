@@ -0,0 +1,161 @@
+import time
+
+from collections import Counter
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, InlineQuery, Message, TelegramObject
+
+from modules.config import config
+from modules.logger import init_logger
+
+logger = init_logger(__name__)
+
+# menu buttons share the limits of the commands they stand for
+BUTTON_COMMANDS = {
+    "📃 Repositories": "repos",
+    "❔ Help": "help",
+    "ℹ️ About": "about",
+    "➕ Add Repository": "add",
+    "➖ Remove Repository": "del",
+    "📋 List of Repositories": "list",
+    "🏠 Menu": "menu",
+}
+# seconds between two "slow down" replies to the same chat and command
+WARN_INTERVAL = 10
+# idle buckets are dropped once there are more than this many
+MAX_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.warned = 0.0
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+def parse_limits(raw: str) -> dict[str, tuple[float, int]]:
+    """
+    Parses "list=0.2/3,delete=1/5" into {command: (rate per second, burst)}.
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        try:
+            command, limit = item.split("=")
+            rate, burst = limit.split("/")
+            limits[command.strip()] = (float(rate), int(burst))
+        except ValueError:
+            logger.error(f"Skipping malformed throttling limit: {item}")
+    return limits
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Per-chat and per-command token buckets. Requests identical to one that is still
+    being handled are dropped, and throttled chats get a cheap "slow down" reply.
+    """
+
+    def __init__(self, rate: float, burst: int, limits: dict[str, tuple[float, int]]):
+        self.default = (rate, burst)
+        self.limits = limits
+        self.buckets: dict[tuple[int, str], TokenBucket] = {}
+        self.in_flight: set[tuple[int, str, str]] = set()
+        self.stats: Counter = Counter()
+
+    @staticmethod
+    def describe(event: TelegramObject) -> tuple[int | None, str, str]:
+        """Returns the chat, the command and the payload of an update."""
+        if isinstance(event, Message):
+            text = (event.text or "").strip()
+            if text.startswith("/"):
+                command = text.split()[0][1:].split("@")[0].lower()
+            else:
+                command = BUTTON_COMMANDS.get(text, "text")
+            return event.chat.id, command, text
+        if isinstance(event, CallbackQuery):
+            data = event.data or ""
+            chat_id = event.message.chat.id if event.message else event.from_user.id
+            return chat_id, data.split("_")[0], data
+        if isinstance(event, InlineQuery):
+            return event.from_user.id, "inline", f"{event.query}:{event.offset}"
+        return None, "", ""
+
+    def bucket(self, chat_id: int, command: str) -> TokenBucket:
+        bucket = self.buckets.get((chat_id, command))
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                now = time.monotonic()
+                self.buckets = {k: b for k, b in self.buckets.items() if not b.idle(now)}
+            rate, burst = self.limits.get(command, self.default)
+            bucket = self.buckets[(chat_id, command)] = TokenBucket(rate, burst)
+        return bucket
+
+    async def slow_down(self, event: TelegramObject, bucket: TokenBucket):
+        if isinstance(event, CallbackQuery):
+            await event.answer("⏳ Too many requests, please slow down.")
+            return
+        if isinstance(event, Message):
+            now = time.monotonic()
+            if now - bucket.warned >= WARN_INTERVAL:
+                bucket.warned = now
+                await event.answer("⏳ Too many requests, please slow down.")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat_id, command, payload = self.describe(event)
+        if chat_id is None:
+            return await handler(event, data)
+
+        request = (chat_id, command, payload)
+        if request in self.in_flight:
+            self.stats[f"{command}.coalesced"] += 1
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+
+        bucket = self.bucket(chat_id, command)
+        if not bucket.take():
+            self.stats[f"{command}.throttled"] += 1
+            logger.debug(f"Chat {chat_id} throttled on {command}")
+            await self.slow_down(event, bucket)
+            return None
+
+        self.stats[f"{command}.allowed"] += 1
+        self.in_flight.add(request)
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight.discard(request)
+
+    def report(self) -> str:
+        lines = [
+            f"default limit: {self.default[0]}/s, burst {self.default[1]}",
+            *(f"{c} limit: {r}/s, burst {b}" for c, (r, b) in sorted(self.limits.items())),
+            f"buckets: {len(self.buckets)}, in flight: {len(self.in_flight)}",
+            "",
+            *(f"{name:<24} {count:>10}" for name, count in sorted(self.stats.items())),
+        ]
+        return "\n".join(lines)
+
+
+throttling = ThrottlingMiddleware(
+    config.THROTTLE_RATE, config.THROTTLE_BURST, parse_limits(config.THROTTLE_LIMITS)
+)
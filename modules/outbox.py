@@ -0,0 +1,132 @@
+import asyncio, time
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramNotFound,
+)
+
+from modules.config import config
+from modules.db.requests import (
+    get_pending_outbox,
+    mark_outbox_delivered,
+    mark_outbox_failed,
+    purge_outbox,
+)
+from modules.debug import stage
+from modules.logger import init_logger
+
+logger = init_logger(__name__)
+
+# telegram message length limit
+MESSAGE_LIMIT = 4096
+
+# seconds between purges of dead messages
+PURGE_INTERVAL = 3600
+
+# set whenever new messages are written, so the drain loop does not wait for its interval
+_wakeup = asyncio.Event()
+
+
+def notify_outbox():
+    _wakeup.set()
+
+
+def split_message(header: str, lines: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """
+    Groups lines into as few messages as possible within the telegram size limit.
+    """
+    pages, page = [], header
+    for line in lines:
+        if len(page) + len(line) + 1 > limit and page != header:
+            pages.append(page)
+            page = header
+        page = f"{page}\n{line}" if page else line
+    pages.append(page)
+    return pages
+
+
+async def deliver_chat(bot: Bot, chat_id: int, messages):
+    """
+    Sends the pending messages of one chat, merged into as few messages as possible.
+    """
+    pages = split_message("", [m.text for m in messages])
+    try:
+        with stage("send"):
+            for page in pages:
+                await bot.send_message(chat_id, page)
+    except TelegramRetryAfter as e:
+        logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after} seconds.")
+        await mark_outbox_failed(
+            [m.id for m in messages],
+            datetime.now() + timedelta(seconds=e.retry_after),
+            dead=False,
+            count_attempt=False,
+        )
+        return
+    except (TelegramForbiddenError, TelegramNotFound) as e:
+        logger.warning(f"Chat {chat_id} is unreachable, dropping its messages: {e}")
+        await mark_outbox_failed([m.id for m in messages], None, dead=True)
+        return
+    except Exception as e:
+        attempts = max(m.attempts for m in messages) + 1
+        dead = attempts >= config.OUTBOX_MAX_ATTEMPTS
+        delay = min(5 * 2**attempts, 3600)
+        logger.exception(
+            f"Failed to deliver {len(messages)} message(s) to chat {chat_id}, "
+            f"attempt {attempts}: {e}"
+        )
+        await mark_outbox_failed(
+            [m.id for m in messages], datetime.now() + timedelta(seconds=delay), dead
+        )
+        return
+
+    await mark_outbox_delivered([m.id for m in messages])
+    logger.info(f"{len(messages)} notification(s) delivered to chat {chat_id}")
+
+
+async def start_outbox(bot: Bot):
+    """
+    Drains the outbox: messages written together with version updates are sent
+    in batches and marked delivered, so nothing is lost between restarts.
+    """
+
+    logger.info(f"Outbox delivery started, batch size {config.OUTBOX_BATCH}.")
+
+    purged_at = 0.0
+    while True:
+        _wakeup.clear()
+        if time.monotonic() - purged_at >= PURGE_INTERVAL:
+            purged_at = time.monotonic()
+            try:
+                before = datetime.now() - timedelta(days=config.OUTBOX_RETENTION_DAYS)
+                if purged := await purge_outbox(before):
+                    logger.info(f"{purged} dead message(s) purged from the outbox.")
+            except Exception as e:
+                logger.exception(f"Failed to purge the outbox: {e}")
+
+        batch = []
+        try:
+            batch = await get_pending_outbox(config.OUTBOX_BATCH)
+            chats = defaultdict(list)
+            for message in batch:
+                chats[message.chat_id].append(message)
+
+            await asyncio.gather(
+                *(deliver_chat(bot, chat_id, messages) for chat_id, messages in chats.items())
+            )
+        except Exception as e:
+            logger.exception(f"Global outbox loop error: {e}")
+
+        # a full batch means there is more to send, telegram allows about 30 messages per second
+        if len(batch) >= config.OUTBOX_BATCH:
+            await asyncio.sleep(1)
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), config.OUTBOX_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,87 @@
+import asyncio, time
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from contextlib import asynccontextmanager
+
+from modules.config import config
+from modules.logger import init_logger
+
+logger = init_logger(__name__)
+
+
+class HostPool:
+    """
+    Connection pool, concurrency cap and request budget of one provider host,
+    so a slow instance only ever waits on its own connections.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        concurrency: int | None = None,
+        rate: float | None = None,
+        timeout: float | None = None,
+        headers: dict | None = None,
+    ):
+        self.host = host
+        self.concurrency = concurrency or config.POOL_CONCURRENCY
+        self.rate = config.POOL_RATE if rate is None else rate  # requests per second
+        self.timeout = timeout or config.POOL_TIMEOUT
+        self.headers = headers or {}
+        self._session: ClientSession | None = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._next_slot = 0.0
+
+    def session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(limit=self.concurrency),
+                timeout=ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+            logger.debug(f"Connection pool created for {self.host}")
+        return self._session
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Waits for a free connection and for the next request allowed by the rate budget.
+        """
+        async with self._semaphore:
+            if self.rate:
+                now = time.monotonic()
+                wait = self._next_slot - now
+                self._next_slot = max(now, self._next_slot) + 1 / self.rate
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            yield self.session()
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+# host -> pool settings and created pools
+_settings: dict[str, dict] = {}
+_pools: dict[str, HostPool] = {}
+
+
+def configure_pool(host: str, **settings):
+    """
+    Stores per-host settings, used when the pool for the host is created.
+    """
+    _settings[host] = settings
+
+
+def get_pool(host: str) -> HostPool:
+    pool = _pools.get(host)
+    if pool is None:
+        pool = _pools[host] = HostPool(host, **_settings.get(host, {}))
+    return pool
+
+
+async def close_pools():
+    for pool in _pools.values():
+        await pool.close()
+    _pools.clear()
+    logger.info("Provider connection pools closed.")
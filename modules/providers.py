@@ -1,16 +1,72 @@
-import re
+import re, json, time
 
 from aiohttp import ClientSession
 from typing import Optional, Tuple, Type
+from base64 import b64encode
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from urllib.parse import quote_plus
 
+from modules.config import config
 from modules.logger import init_logger
+from modules.pools import configure_pool, get_pool
 
 logger = init_logger(__name__)
 
 # to detect only numbered versions in Docker Hub like v1.25.3 or 1.25.3 etc.
 SEMVER = re.compile(r"^v?(\d+)\.(\d+)(?:\.(\d+))?(?:[-+][\w.]+)?$")
+# responses meaning the repository was deleted, made private or blocked
+GONE_STATUSES = {404, 410, 451}
+
+
+class RepositoryGone(Exception):
+    """The provider no longer serves the repository."""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"Request to URL {url} failed with status [{status}]")
+        self.status = status
+
+
+class RepositoryMoved(Exception):
+    """The provider redirected the repository to another location."""
+
+    def __init__(self, url: str, location: str):
+        super().__init__(f"Request to URL {url} was redirected to {location}")
+        self.location = location
+
+
+@dataclass
+class EndpointMemo:
+    """
+    Remembers which endpoints serve versions for a repository.
+    None means the endpoint has not been probed yet.
+    """
+
+    releases: bool | None = None
+    tags: bool | None = None
+    probed_at: datetime | None = None
+    # endpoint the last returned version came from, not stored
+    source: str | None = field(default=None, compare=False)
+
+    def known_source(self) -> str | None:
+        """The endpoint versions come from according to the memo, None if never probed."""
+        if self.releases is None:
+            return None
+        return "releases" if self.releases else "tags"
+
+    def should_try(self, endpoint: str) -> bool:
+        """Endpoints known to be empty are only re-probed once the memo goes stale."""
+        if getattr(self, endpoint) is not False:
+            return True
+        return self.probed_at is None or datetime.now() - self.probed_at > timedelta(
+            seconds=config.CAPABILITY_REPROBE
+        )
+
+    def record(self, endpoint: str, works: bool):
+        setattr(self, endpoint, works)
+        if not works:
+            self.probed_at = datetime.now()
 
 
 # providers configuration
@@ -18,23 +74,62 @@ class Provider(ABC):
     """Base provider class."""
 
     name: str
+    host: str
     regex: re.Pattern[str]
     url_fmt: str
     url_api: str
+    # endpoint the versions of subscriptions predating the endpoint memo came from
+    legacy_source: str | None = None
+    # API root and link pattern of self-hosted instances
+    api_fmt: str = ""
+    regex_fmt: str = r"{host}/([^/]+)/([^/]+?)(?:\.git)?(?:/|$)"
 
     registry: list[Type["Provider"]] = []
 
     def __init_subclass__(cls, **kwargs):
-        """Automatically registers all children."""
+        """Automatically registers all children, except the ones marked abstract."""
         super().__init_subclass__(**kwargs)
-        if not getattr(cls, "abstract", False):
+        if not cls.__dict__.get("abstract", False):
             Provider.registry.append(cls)
             logger.debug(f"Registered provider: {cls.__name__}")
 
+    @classmethod
+    def for_instance(cls, host: str, name: str | None = None) -> Type["Provider"]:
+        """Creates and registers a provider for a self-hosted instance of this forge."""
+        provider = type(
+            f"{cls.__name__}[{host}]",
+            (cls,),
+            {
+                "name": name or f"{cls.name}@{host}",
+                "host": host,
+                "regex": re.compile(cls.regex_fmt.replace("{host}", re.escape(host))),
+                "url_fmt": f"https://{host}/{{namespace}}/{{repository}}",
+                "url_api": cls.api_fmt.format(host=host),
+            },
+        )
+        # instance hosts are more specific than the public ones, so they are matched first
+        Provider.registry.remove(provider)
+        Provider.registry.insert(0, provider)
+        return provider
+
+    @classmethod
+    def auth_headers(cls, token: str) -> dict:
+        """Headers that authenticate requests to an instance with the token."""
+        return {"Authorization": f"Bearer {token}"}
+
+    @classmethod
+    async def get_json(cls, url: str, headers: dict | None = None, **kwargs):
+        """Requests JSON through the connection pool of the provider host."""
+        async with get_pool(cls.host).slot() as session:
+            return await fetch_json(session, url, headers, **kwargs)
+
     @classmethod
     @abstractmethod
     async def fetch_latest(
-        cls, session: ClientSession, namespace: str, repository: str
+        cls,
+        namespace: str,
+        repository: str,
+        memo: EndpointMemo | None = None,
     ) -> Optional[str] | None:
         """Returns the latest release version or tag."""
         pass
@@ -45,6 +140,13 @@ class Provider(ABC):
         """Extract namespace and repository from regex match."""
         pass
 
+    @classmethod
+    async def resolve_moved(
+        cls, namespace: str, repository: str
+    ) -> tuple[str, str] | None:
+        """Returns the new namespace and repository of a renamed repository."""
+        return None
+
     @classmethod
     def repository_detect(
         cls, link: str
@@ -86,6 +188,7 @@ class Provider(ABC):
 
 class GitHubProvider(Provider):
     name = "GitHub"
+    host = "github.com"
     regex = re.compile(r"github\.com/([^/]+)/([^/]+?)(?:\.git)?(?:/|$)")
     url_fmt = "https://github.com/{namespace}/{repository}"
     url_api = "https://api.github.com/repos"
@@ -96,30 +199,68 @@ class GitHubProvider(Provider):
 
     @classmethod
     async def fetch_latest(
-        cls, session: ClientSession, namespace: str, repository: str
+        cls,
+        namespace: str,
+        repository: str,
+        memo: EndpointMemo | None = None,
     ) -> str | None:
         headers = {"User-Agent": "repo-watchtower"}
-        url_release = f"{cls.url_api}/{namespace}/{repository}/releases/latest"
+        memo = memo or EndpointMemo()
 
-        # trying to get releases first
-        releases = await fetch_json(session, url_release, headers)
-        if releases:
-            return releases.get("tag_name") or releases.get("name")  # type: ignore
+        # trying to get releases first, 404 here only means there are no releases
+        if memo.should_try("releases"):
+            url_release = f"{cls.url_api}/{namespace}/{repository}/releases/latest"
+            releases = await cls.get_json(
+                url_release, headers, detect_moves=True, missing_ok=True
+            )
+            # rate limits and server errors say nothing about releases, retry next cycle
+            if releases is None:
+                return None
+            memo.record("releases", bool(releases))
+            if releases:
+                memo.source = "releases"
+                return releases.get("tag_name") or releases.get("name")  # type: ignore
 
         # if there are no releases, trying to get tags
         url_tags = f"{cls.url_api}/{namespace}/{repository}/tags"
-        tags = await fetch_json(session, url_tags, headers)
+        tags = await cls.get_json(
+            url_tags, headers, strict=True, detect_moves=True
+        )
+        if tags is None:
+            return None
+        memo.record("tags", bool(tags))
         if tags and isinstance(tags, list):
+            memo.source = "tags"
             return tags[0].get("name")
 
         return None
 
+    @classmethod
+    async def resolve_moved(
+        cls, namespace: str, repository: str
+    ) -> tuple[str, str] | None:
+        # renamed repositories redirect to /repositories/<id>, which knows the new name
+        headers = {"User-Agent": "repo-watchtower"}
+        data = await cls.get_json(f"{cls.url_api}/{namespace}/{repository}", headers)
+        if not data or "/" not in data.get("full_name", ""):  # type: ignore
+            return None
+        new_namespace, new_repository = data["full_name"].split("/", 1)  # type: ignore
+        return new_namespace, new_repository
+
 
 class GitLabProvider(Provider):
     name = "GitLab"
+    host = "gitlab.com"
     regex = re.compile(r"gitlab\.com/([^/]+)/([^/]+?)(?:\.git)?(?:/|$)")
     url_fmt = "https://gitlab.com/{namespace}/{repository}"
     url_api = "https://gitlab.com/api/v4/projects"
+    api_fmt = "https://{host}/api/v4/projects"
+    # only tags were checked before releases were
+    legacy_source = "tags"
+
+    @classmethod
+    def auth_headers(cls, token: str) -> dict:
+        return {"PRIVATE-TOKEN": token}
 
     @classmethod
     def parse_match(cls, match: re.Match) -> tuple[str, str]:
@@ -127,13 +268,81 @@ class GitLabProvider(Provider):
 
     @classmethod
     async def fetch_latest(
-        cls, session: ClientSession, namespace: str, repository: str
+        cls,
+        namespace: str,
+        repository: str,
+        memo: EndpointMemo | None = None,
     ) -> str | None:
         path = quote_plus(f"{namespace}/{repository}")
+        memo = memo or EndpointMemo()
+
+        # releases are listed newest first, tags are the fallback
+        if memo.should_try("releases"):
+            url_releases = f"{cls.url_api}/{path}/releases?per_page=1"
+            releases = await cls.get_json(url_releases, missing_ok=True)
+            # rate limits and server errors say nothing about releases, retry next cycle
+            if releases is None:
+                return None
+            memo.record("releases", bool(releases))
+            if releases and isinstance(releases, list):
+                memo.source = "releases"
+                return releases[0].get("tag_name") or releases[0].get("name")
+
         url = f"{cls.url_api}/{path}/repository/tags"
+        tags = await cls.get_json(url, strict=True)
+        if tags is None:
+            return None
+        memo.record("tags", bool(tags))
+        if tags and isinstance(tags, list):
+            memo.source = "tags"
+            return tags[0].get("name")
+
+        return None
+
+
+class GiteaProvider(Provider):
+    """Gitea and Forgejo, only available as configured self-hosted instances."""
 
-        tags = await fetch_json(session, url)
+    abstract = True
+    name = "Gitea"
+    api_fmt = "https://{host}/api/v1/repos"
+
+    @classmethod
+    def auth_headers(cls, token: str) -> dict:
+        return {"Authorization": f"token {token}"}
+
+    @classmethod
+    def parse_match(cls, match: re.Match) -> tuple[str, str]:
+        return match.group(1), match.group(2)
+
+    @classmethod
+    async def fetch_latest(
+        cls,
+        namespace: str,
+        repository: str,
+        memo: EndpointMemo | None = None,
+    ) -> str | None:
+        memo = memo or EndpointMemo()
+
+        # trying to get releases first, 404 here only means there are no releases
+        if memo.should_try("releases"):
+            url_release = f"{cls.url_api}/{namespace}/{repository}/releases/latest"
+            releases = await cls.get_json(url_release, missing_ok=True)
+            # rate limits and server errors say nothing about releases, retry next cycle
+            if releases is None:
+                return None
+            memo.record("releases", bool(releases))
+            if releases:
+                memo.source = "releases"
+                return releases.get("tag_name") or releases.get("name")  # type: ignore
+
+        url_tags = f"{cls.url_api}/{namespace}/{repository}/tags?limit=1"
+        tags = await cls.get_json(url_tags, strict=True)
+        if tags is None:
+            return None
+        memo.record("tags", bool(tags))
         if tags and isinstance(tags, list):
+            memo.source = "tags"
             return tags[0].get("name")
 
         return None
@@ -141,6 +350,7 @@ class GitLabProvider(Provider):
 
 class DockerHubProvider(Provider):
     name = "Docker Hub"
+    host = "hub.docker.com"
     regex = re.compile(r"hub\.docker\.com/(?:r/([^/]+)/|_+/)?([^/]+)(?:/|$)")
     url_fmt = "https://hub.docker.com/r/{namespace}/{repository}"
     url_api = "https://hub.docker.com/v2/repositories"
@@ -156,13 +366,16 @@ class DockerHubProvider(Provider):
 
     @classmethod
     async def fetch_latest(
-        cls, session: ClientSession, namespace: str, repository: str
+        cls,
+        namespace: str,
+        repository: str,
+        memo: EndpointMemo | None = None,
     ) -> str | None:
         if namespace in {"_", "", None}:
             namespace = "library"
 
         url = f"{cls.url_api}/{namespace}/{repository}/tags?page_size=10&ordering=last_updated"
-        data = await fetch_json(session, url)
+        data = await cls.get_json(url, strict=True)
         if not data:
             return None
 
@@ -175,20 +388,167 @@ class DockerHubProvider(Provider):
         return semver_tags[0] if semver_tags else tags[0]
 
 
+class OCIRegistryProvider(Provider):
+    """
+    Generic OCI Distribution registry, speaking /v2/<name>/tags/list.
+    Anonymous or credential-based bearer tokens are cached until they expire,
+    and tag lists are compared with the previous poll so only new tags are sorted.
+    """
+
+    abstract = True
+    name = "OCI"
+    api_fmt = "https://{host}/v2"
+    regex_fmt = r"{host}/([^/\s]+)/([^\s:@?#]+?)(?::[\w.-]+)?(?:@sha256:[0-9a-f]+)?(?:[?#].*)?$"
+    page_size = 1000
+
+    # (host, image) -> (bearer token, expiry on the monotonic clock)
+    _tokens: dict[tuple[str, str], tuple[str, float]] = {}
+    # (host, image) -> (tags seen on the previous poll, best semver tag among them)
+    _seen: dict[tuple[str, str], tuple[set[str], str | None]] = {}
+
+    @classmethod
+    def auth_headers(cls, token: str) -> dict:
+        # "user:password" credentials, presented to the token endpoint
+        return {"Authorization": f"Basic {b64encode(token.encode()).decode()}"}
+
+    @classmethod
+    def parse_match(cls, match: re.Match) -> tuple[str, str]:
+        return match.group(1), match.group(2)
+
+    @classmethod
+    async def fetch_token(
+        cls, session: ClientSession, image: str, challenge: str
+    ) -> str | None:
+        """
+        Requests a bearer token as described by the WWW-Authenticate challenge.
+        """
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm", None)
+        if not realm or not challenge.lower().startswith("bearer"):
+            return None
+
+        data = await fetch_json(session, realm, params=params)
+        if not data:
+            return None
+        token = data.get("token") or data.get("access_token")  # type: ignore
+        if token:
+            lifetime = max(int(data.get("expires_in") or 60) - 10, 10)  # type: ignore
+            cls._tokens[(cls.host, image)] = (token, time.monotonic() + lifetime)
+        return token
+
+    @classmethod
+    async def list_tags(cls, image: str) -> list[str] | None:
+        """
+        Collects the whole tag list, following the Link header pagination.
+        Returns None if any page fails, a partial list would hide the newest tags.
+        """
+        tags = []
+        url = f"{cls.url_api}/{image}/tags/list?n={cls.page_size}"
+        # one new token per page, a second 401 is a real failure
+        refreshed = False
+        async with get_pool(cls.host).slot() as session:
+            while url:
+                cached = cls._tokens.get((cls.host, image))
+                headers = {}
+                if cached and cached[1] > time.monotonic():
+                    headers["Authorization"] = f"Bearer {cached[0]}"
+
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 401 and not refreshed:
+                        refreshed = True
+                        # a cached token may be revoked before it expires
+                        cls._tokens.pop((cls.host, image), None)
+                        challenge = response.headers.get("WWW-Authenticate", "")
+                        if await cls.fetch_token(session, image, challenge):
+                            continue
+                    if response.status in GONE_STATUSES:
+                        raise RepositoryGone(url, response.status)
+                    if response.status != 200:
+                        logger.warning(
+                            f"Request to URL {url} failed with status [{response.status}]"
+                        )
+                        return None
+                    refreshed = False
+                    data = await response.json()
+                    tags.extend(data.get("tags") or [])
+                    next_page = response.links.get("next", {}).get("url")
+                    url = str(response.url.join(next_page)) if next_page else None
+        return tags
+
+    @classmethod
+    async def fetch_latest(
+        cls,
+        namespace: str,
+        repository: str,
+        memo: EndpointMemo | None = None,
+    ) -> str | None:
+        image = f"{namespace}/{repository}"
+        key = (cls.host, image)
+        tags = await cls.list_tags(image)
+        if not tags:
+            return None
+
+        known, best = cls._seen.get(key, (set(), None))
+        if best and best in tags:
+            # only tags that appeared since the previous poll compete with the known best
+            candidates = [t for t in tags if t not in known] + [best]
+        else:
+            candidates = tags
+        semver_tags = filter_semver(candidates)
+        best = semver_tags[0] if semver_tags else None
+        cls._seen[key] = (set(tags), best)
+        return best
+
+
+class GHCRProvider(OCIRegistryProvider):
+    name = "GHCR"
+    host = "ghcr.io"
+    regex = re.compile(OCIRegistryProvider.regex_fmt.replace("{host}", r"ghcr\.io"))
+    url_fmt = "https://ghcr.io/{namespace}/{repository}"
+    url_api = "https://ghcr.io/v2"
+
+
+class QuayProvider(OCIRegistryProvider):
+    name = "Quay"
+    host = "quay.io"
+    regex = re.compile(
+        r"quay\.io/(?:repository/)?([^/\s]+)/([^\s:@?#]+?)(?::[\w.-]+)?(?:@sha256:[0-9a-f]+)?(?:[?#].*)?$"
+    )
+    url_fmt = "https://quay.io/repository/{namespace}/{repository}"
+    url_api = "https://quay.io/v2"
+
+
 async def fetch_json(
-    session: ClientSession, url: str, headers: dict | None = None
+    session: ClientSession,
+    url: str,
+    headers: dict | None = None,
+    strict: bool = False,
+    detect_moves: bool = False,
+    params: dict | None = None,
+    missing_ok: bool = False,
 ) -> dict | list | None:
     """
     A general-purpose method for securely requesting JSON.
+    With strict, a missing repository raises RepositoryGone instead of returning None.
+    With detect_moves, a redirected request raises RepositoryMoved.
+    With missing_ok, a 404 returns an empty list, so None only means the request failed.
     """
     try:
-        async with session.get(url, headers=headers) as request:
+        async with session.get(url, headers=headers, params=params) as request:
+            if detect_moves and request.history:
+                raise RepositoryMoved(url, str(request.url))
             if request.status == 200:
                 return await request.json()
+            if missing_ok and request.status == 404:
+                return []
+            if strict and request.status in GONE_STATUSES:
+                raise RepositoryGone(url, request.status)
             logger.warning(
                 f"Request to URL {url} failed with status [{request.status}]"
             )
             return None
+    except (RepositoryGone, RepositoryMoved):
+        raise
     except Exception as e:
         logger.exception(f"Request error for URL {url}: {e}")
         return None
@@ -205,3 +565,49 @@ def filter_semver(tags: list[str]) -> list[str]:
         key=lambda t: [int(x) for x in re.findall(r"\d+", t)],
         reverse=True,
     )
+
+
+# self-hosted instances
+INSTANCE_KINDS: dict[str, Type[Provider]] = {
+    "gitlab": GitLabProvider,
+    "gitea": GiteaProvider,
+    "forgejo": GiteaProvider,
+    "oci": OCIRegistryProvider,
+}
+
+
+def register_instances(raw: str):
+    """
+    Registers providers for the self-hosted instances listed in FORGE_INSTANCES,
+    a JSON list like [{"kind": "gitlab", "host": "git.example.com", "token": "..."}].
+    Optional keys: name, concurrency, rate (requests per second), timeout (seconds).
+    For "oci" registries the token is a "user:password" pair for the token endpoint.
+    """
+    if not raw:
+        return
+    try:
+        instances = json.loads(raw)
+    except ValueError as e:
+        logger.error(f"FORGE_INSTANCES is not valid JSON: {e}")
+        return
+
+    for instance in instances:
+        kind = INSTANCE_KINDS.get(str(instance.get("kind", "")).lower())
+        host = instance.get("host", "").strip().rstrip("/")
+        if not kind or not host:
+            logger.error(f"Skipping forge instance with unknown kind or host: {instance}")
+            continue
+
+        token = instance.get("token")
+        configure_pool(
+            host,
+            concurrency=instance.get("concurrency"),
+            rate=instance.get("rate"),
+            timeout=instance.get("timeout"),
+            headers=kind.auth_headers(token) if token else None,
+        )
+        provider = kind.for_instance(host, instance.get("name"))
+        logger.info(f"Self-hosted {kind.name} instance registered: {provider.name}")
+
+
+register_instances(config.FORGE_INSTANCES)
@@ -1,37 +1,66 @@
-import asyncio, aiohttp
+import asyncio
 
-from aiogram import Bot, html
+from contextlib import suppress
+from dataclasses import replace
+from datetime import datetime, timedelta
+from aiogram import html
 
 from modules.config import config
-from modules.db.requests import get_all_trackings, update_tracking_version
+from modules.db.requests import (
+    update_tracking_version,
+    queue_release,
+    get_due_digests,
+    enqueue_digest,
+    record_release,
+    enqueue_messages,
+    rename_repository,
+    record_repository_failure,
+    clear_repository_state,
+    save_endpoint_capability,
+    set_baseline_version,
+)
 from modules.logger import init_logger
-from modules.providers import Provider
+from modules.debug import stage
+from modules.index import index
+from modules.outbox import notify_outbox, split_message
+from modules.providers import Provider, EndpointMemo, RepositoryGone, RepositoryMoved
 
 logger = init_logger(__name__)
 
+# digest delivery windows in seconds
+DIGEST_WINDOWS = {"immediate": 0, "hourly": 3600, "daily": 86400}
 
-async def process_tracking_item(bot: Bot, session: aiohttp.ClientSession, item):
+
+async def process_tracking_item(
+    item, latest: str, mode: str = "immediate", rebaseline: bool = False
+):
     """
     Processing one track.
+    With rebaseline the version comes from another endpoint than the stored one,
+    so it is not comparable and is recorded without a notification.
     """
     try:
-        provider_cls = next(
-            (p for p in Provider.registry if p.name == item.provider), None
-        )
-        if not provider_cls:
-            logger.warning(f"Unknown provider {item.provider} for {item.fullname}.")
+        # the first known version is only a baseline, there is nothing to announce
+        if item.version is None or (rebaseline and item.version != latest):
+            index.write_behind(
+                [item], latest, lambda: update_tracking_version(item.id, latest)
+            )
+            logger.info(f"{item.provider}: Baseline for {item.fullname}: {latest}")
             return
 
-        latest = await provider_cls.fetch_latest(session, item.namespace, item.repository)  
-        if not latest:
-            logger.debug(f"No new version found for {item.fullname}.")
-            return
+        with stage("compare"):
+            changed = item.version != latest
 
-        if item.version != latest:
+        if changed:
             logger.info(
                 f"{item.provider}: Found new version for {item.fullname}: {latest}"
             )
-            await update_tracking_version(item.id, latest)
+
+            # digest subscribers get the release later in a grouped message
+            if mode != "immediate":
+                index.write_behind([item], latest, lambda: queue_release(item, latest))
+                logger.debug(f"Release queued for {mode} digest of chat {item.chat_id}")
+                return
 
             message = (
                 f'{html.bold("🔔New release!")}\n'
@@ -40,11 +69,13 @@ async def process_tracking_item(bot: Bot, session: aiohttp.ClientSession, item):
                 f"Link: {item.url}\n"
             )
 
-            try:
-                await bot.send_message(item.chat_id, message)
-                logger.info(f"Notification sent to chat {item.chat_id}")
-            except Exception as e:
-                logger.exception(f"Failed to send notification: {e}")
+            # the version and its notification are saved together, the outbox sends it
+            async def write():
+                await record_release(item.id, latest, item.chat_id, message)
+                notify_outbox()
+
+            index.write_behind([item], latest, write)
+            logger.debug(f"Notification queued for chat {item.chat_id}")
 
         else:
             logger.debug(f"No updates for {item.fullname} (current: {item.version})")
@@ -55,26 +86,276 @@ async def process_tracking_item(bot: Bot, session: aiohttp.ClientSession, item):
         )
 
 
-async def start_tracking(bot: Bot):
+def repository_key(item) -> tuple[str, str, str]:
+    return item.provider, item.namespace, item.repository
+
+
+def get_provider(name: str):
+    with stage("provider lookup"):
+        return next((p for p in Provider.registry if p.name == name), None)
+
+
+def load_memo(capability) -> EndpointMemo:
+    """
+    Endpoints remembered from previous checks.
+    """
+    if not capability:
+        return EndpointMemo()
+    return EndpointMemo(capability.releases, capability.tags, capability.probed_at)
+
+
+async def fetch_repository(provider_cls, items, memo: EndpointMemo):
+    """
+    Requests the latest version once for all subscribers of a repository.
+    Renamed repositories are rewritten in the database and requested again,
+    the index follows through the change hook.
+    Returns the key of the repository that was requested and its latest version.
+    """
+    item = items[0]
+    try:
+        latest = await provider_cls.fetch_latest(item.namespace, item.repository, memo)
+        return repository_key(item), latest
+    except RepositoryMoved as e:
+        moved = await provider_cls.resolve_moved(item.namespace, item.repository)
+        if not moved or moved == (item.namespace, item.repository):
+            logger.warning(f"Unable to resolve the new location of {item.fullname}.")
+            raise RepositoryGone(e.location, 301)
+
+    namespace, repository = moved
+    url = provider_cls.url_fmt.format(namespace=namespace, repository=repository)
+    logger.info(f"{item.provider}: {item.fullname} moved to {namespace}/{repository}")
+    await rename_repository(
+        item.provider, item.namespace, item.repository, namespace, repository, url
+    )
+
+    latest = await provider_cls.fetch_latest(namespace, repository, memo)
+    return (item.provider, namespace, repository), latest
+
+
+async def mark_unavailable(items, state, status: int):
+    """
+    Puts a repository into exponential backoff and eventually into dormant state.
+    Subscribers are notified once, when the repository goes dormant.
+    """
+    item = items[0]
+    failures = (state.failures if state else 0) + 1
+    delay = min(config.POLL_INTERVAL * 2**failures, config.BACKOFF_MAX)
+    dormant = failures >= config.DORMANT_AFTER
+    await record_repository_failure(
+        *repository_key(item),
+        status=status,
+        retry_at=datetime.now() + timedelta(seconds=delay),
+        dormant=dormant,
+    )
+    logger.warning(
+        f"{item.provider}: {item.fullname} is unavailable [{status}], "
+        f"failure {failures}, next check in {delay} seconds."
+    )
+
+    if not dormant or (state and state.dormant):
+        return
+
+    message = (
+        f'{html.bold("⚠️ Repository unavailable")}\n'
+        f"{html.link(item.fullname, item.url)} was deleted, renamed or made private.\n"
+        f"Checks are now rare, remove it with /del if it is gone for good."
+    )
+    await enqueue_messages([track.chat_id for track in items], message)
+    notify_outbox()
+
+
+async def process_repository(
+    items,
+    modes: dict,
+    state=None,
+    capability=None,
+):
+    """
+    Processing all tracks of one repository.
+    """
+    item = items[0]
+    key = repository_key(item)
+    try:
+        provider_cls = get_provider(item.provider)
+        if not provider_cls:
+            logger.warning(f"Unknown provider {item.provider} for {item.fullname}.")
+            return
+
+        if state and state.retry_at and state.retry_at > datetime.now():
+            logger.debug(f"Skipping {item.fullname} until {state.retry_at}.")
+            return
+
+        memo = load_memo(capability)
+        known = replace(memo)
+
+        try:
+            with stage("fetch"):
+                fetched, latest = await fetch_repository(provider_cls, items, memo)
+        except RepositoryGone as e:
+            await mark_unavailable(items, state, e.status)
+            return
+
+        # after a rename the index holds the subscribers of the new location,
+        # stale entries of chats that already followed it are gone
+        if fetched != key:
+            key = fetched
+            items = index.subscribers(key)
+            if not items:
+                return
+            item = items[0]
+
+        if memo != known:
+            await save_endpoint_capability(
+                *key, memo.releases, memo.tags, memo.probed_at
+            )
+
+        if state:
+            await clear_repository_state(*key)
+            logger.info(f"{item.provider}: {item.fullname} is available again.")
+
+        if not latest:
+            logger.debug(f"No new version found for {item.fullname}.")
+            return
+
+        # versions from releases and from tags are not comparable
+        previous = known.known_source() or provider_cls.legacy_source
+        rebaseline = bool(previous and memo.source and memo.source != previous)
+        if rebaseline:
+            logger.info(
+                f"{item.provider}: {item.fullname} now versioned by {memo.source}, re-baselining."
+            )
+
+        for track in items:
+            await process_tracking_item(
+                track, latest, modes.get(track.chat_id, "immediate"), rebaseline
+            )
+
+    except Exception as e:
+        logger.exception(
+            f"Error processing {item.provider}: {item.fullname}. Error message: {e}"
+        )
+
+
+# fast lane for new subscriptions: queued repository keys and their pending baselines
+_fast_lane: asyncio.Queue | None = None
+_in_flight: dict[tuple[str, str, str], asyncio.Future] = {}
+
+
+async def request_baseline(provider: str, namespace: str, repository: str) -> str | None:
+    """
+    Asks the tracker for the current version of a newly added repository.
+    Chats adding the same repository at the same moment share one request.
+    Returns None if the tracker is not running or the check takes too long.
+    """
+    if _fast_lane is None:
+        return None
+
+    key = (provider, namespace, repository)
+    future = _in_flight.get(key)
+    if future is None:
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        _fast_lane.put_nowait(key)
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), config.FAST_LANE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Fast lane check for {namespace}/{repository} timed out.")
+        return None
+
+
+async def check_baseline(key: tuple[str, str, str], limit: asyncio.Semaphore):
+    """
+    Records the current version of a new repository without notifying anyone.
+    """
+    provider, namespace, repository = key
+    version = None
+    try:
+        async with limit:
+            provider_cls = get_provider(provider)
+            if not provider_cls:
+                return
+
+            memo = load_memo(index.capabilities.get(key))
+            known = replace(memo)
+            with stage("fetch"):
+                version = await provider_cls.fetch_latest(namespace, repository, memo)
+            if memo != known:
+                await save_endpoint_capability(
+                    *key, memo.releases, memo.tags, memo.probed_at
+                )
+
+            if version:
+                pending = [t for t in index.subscribers(key) if t.version is None]
+                index.write_behind(
+                    pending, version, lambda: set_baseline_version(*key, version)
+                )
+                logger.info(f"{provider}: Baseline for {namespace}/{repository}: {version}")
+    except Exception as e:
+        logger.warning(f"Fast lane check failed for {namespace}/{repository}: {e}")
+    finally:
+        future = _in_flight.pop(key, None)
+        if future and not future.done():
+            future.set_result(version)
+
+
+async def run_fast_lane():
+    """
+    Priority lane that checks new subscriptions right away instead of on the next sweep.
+    """
+    global _fast_lane
+    _fast_lane = asyncio.Queue()
+    limit = asyncio.Semaphore(config.FAST_LANE_CONCURRENCY)
+    tasks = set()
+
+    try:
+        while True:
+            key = await _fast_lane.get()
+            task = asyncio.create_task(check_baseline(key, limit))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        _fast_lane = None
+        for task in tasks:
+            task.cancel()
+
+
+async def start_tracking():
     """
     Main version monitoring cycle.
     """
 
     logger.info(f"Tracking started with interval {config.POLL_INTERVAL} seconds.")
 
-    async with aiohttp.ClientSession() as session:
-        while session:
+    await index.load()
+    writer = asyncio.create_task(index.run_writer())
+    fast_lane = asyncio.create_task(run_fast_lane())
+    try:
+        while True:
             try:
-                trackings = await get_all_trackings()
-                if not trackings:
+                if index.reconcile_due():
+                    await index.reconcile()
+
+                # one request per repository, however many chats follow it
+                repositories = index.snapshot()
+                if not repositories:
                     logger.info("No tracked repositories found")
                     await asyncio.sleep(config.POLL_INTERVAL)
                     continue
-                logger.info(f"Found {len(trackings)} traced repositories.")
+                logger.info(
+                    f"Found {len(index)} traced repositories in {len(repositories)} groups."
+                )
 
                 tasks = [
-                    asyncio.create_task(process_tracking_item(bot, session, item))
-                    for item in trackings
+                    asyncio.create_task(
+                        process_repository(
+                            items,
+                            index.modes,
+                            index.states.get(repository_key(items[0])),
+                            index.capabilities.get(repository_key(items[0])),
+                        )
+                    )
+                    for items in repositories
                 ]
                 await asyncio.gather(*tasks)
 
@@ -83,3 +364,44 @@ async def start_tracking(bot: Bot):
 
             logger.info(f"Sleeping for {config.POLL_INTERVAL} seconds.")
             await asyncio.sleep(config.POLL_INTERVAL)
+
+    finally:
+        fast_lane.cancel()
+        writer.cancel()
+        with suppress(asyncio.CancelledError):
+            await writer
+
+
+def build_digest(releases) -> list[str]:
+    """
+    Renders the accumulated releases of one chat as grouped message pages.
+    """
+    header = html.bold(f"🔔New releases: {len(releases)}")
+    lines = [
+        f'{html.link(r.fullname, r.url)} ({r.provider}): {html.bold(r.version)}'
+        for r in releases
+    ]
+    return split_message(header, lines)
+
+
+async def start_digest():
+    """
+    Delivery cycle for chats that receive releases in batches.
+    """
+
+    logger.info(f"Digest delivery started with interval {config.DIGEST_INTERVAL} seconds.")
+
+    while True:
+        try:
+            for setting, releases in await get_due_digests(DIGEST_WINDOWS):
+                await enqueue_digest(
+                    setting.chat_id, [r.id for r in releases], build_digest(releases)
+                )
+                notify_outbox()
+                logger.info(
+                    f"Digest with {len(releases)} release(s) queued for chat {setting.chat_id}"
+                )
+        except Exception as e:
+            logger.exception(f"Global digest loop error: {e}")
+
+        await asyncio.sleep(config.DIGEST_INTERVAL)
@@ -0,0 +1,346 @@
+"""
+Load test for the webhook endpoint and the handler stack.
+
+Runs the bot application in-process against a fake Bot API backend and a
+throwaway SQLite database, replays realistic updates at increasing concurrency
+and reports throughput, latency percentiles and database contention.
+"db busy" is the summed statement time over wall time: above 100% statements
+overlap and queue on SQLite, "locked" counts "database is locked" errors.
+Command throttling is off unless --throttle is given. Updates the throttling
+middleware drops are tagged as they pass through it, counted separately and
+left out of the throughput and latency figures.
+
+    python -m tools.loadtest --concurrency 1,8,32,128 --chats 64
+    python -m tools.loadtest --replay updates.jsonl --concurrency 16 --throttle
+"""
+
+import argparse, asyncio, itertools, json, os, sys, tempfile, time
+
+# the application reads its configuration on import
+_workdir = tempfile.mkdtemp(prefix="beholder-loadtest-")
+os.environ.setdefault("DB_DSN", os.path.join(_workdir, "loadtest.db"))
+os.environ.setdefault("LOG_DIR", _workdir)
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ["WEBHOOK_URL"] = ""
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from sqlalchemy import event
+
+from modules.db.models import get_engine, init_db
+from modules.db.requests import get_chat_trackings
+from modules.handlers import router
+from modules.middlewares import throttling
+
+TOKEN = "123456:LOADTEST-fake-token-for-local-runs"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Beholder", "username": "beholder_bot"}
+
+# message and update ids
+_ids = itertools.count(1)
+
+
+# fake telegram bot api
+def fake_message(chat_id: int, text: str = "") -> dict:
+    return {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": BOT_USER,
+        "text": text or "…",
+    }
+
+
+async def bot_api_handler(request: web.Request) -> web.Response:
+    method = request.match_info["method"].lower()
+    data = await request.post()
+    chat_id = int(data.get("chat_id") or 0)
+
+    if method == "getme":
+        result = BOT_USER
+    elif method in {"sendmessage", "editmessagetext", "editmessagereplymarkup"}:
+        result = fake_message(chat_id, str(data.get("text", "")))
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+# update payloads
+def user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"load{chat_id}"}
+
+
+def message_update(chat_id: int, text: str) -> dict:
+    message = {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": user(chat_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": next(_ids), "message": message}
+
+
+def callback_update(chat_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "from": user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": fake_message(chat_id, "⛔️ Select the repository"),
+        },
+    }
+
+
+async def scenario(chat_id: int):
+    """
+    One chat going through the usual flows: start, list, add via the FSM, delete.
+    Yields update payloads; the chat's own steps run in order.
+    """
+    yield message_update(chat_id, "/start")
+    yield message_update(chat_id, "/list")
+    for n in range(2):
+        yield message_update(chat_id, "/add")
+        yield message_update(chat_id, f"https://github.com/org{chat_id % 50}/repo{n}")
+        yield message_update(chat_id, "🔙 Return")
+    yield message_update(chat_id, "/list")
+    yield message_update(chat_id, "/find repo")
+    yield message_update(chat_id, "/del")
+    trackings = await get_chat_trackings(chat_id)
+    if trackings:
+        yield callback_update(chat_id, f"delete_{trackings[0].id}")
+    yield message_update(chat_id, "🔙 Return")
+
+
+async def replay(path: str, chat_id: int):
+    """
+    Replays captured updates, moving them into the chat of the virtual user.
+    """
+    with open(path, encoding="UTF-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            update["update_id"] = next(_ids)
+            for key in ("message", "callback_query"):
+                body = update.get(key)
+                if not body:
+                    continue
+                body.setdefault("from", user(chat_id))["id"] = chat_id
+                message = body if key == "message" else body.get("message")
+                if message:
+                    message["chat"] = {"id": chat_id, "type": "private"}
+            yield update
+
+
+# database contention
+class DatabaseStats:
+    def __init__(self):
+        self.reset()
+        sync_engine = get_engine().sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self.before)
+        event.listen(sync_engine, "after_cursor_execute", self.after)
+        event.listen(sync_engine, "handle_error", self.error)
+
+    def reset(self):
+        self.statements = 0
+        self.busy = 0.0
+        self.slowest = 0.0
+        self.locked = 0
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("started", []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["started"].pop()
+        self.statements += 1
+        self.busy += elapsed
+        self.slowest = max(self.slowest, elapsed)
+
+    def error(self, context):
+        if "locked" in str(context.original_exception):
+            self.locked += 1
+
+
+THROTTLED_OBSERVERS = (router.message, router.callback_query, router.inline_query)
+
+# update ids that reached the throttling middleware, and the ones it let through
+_throttle_seen: set[int] = set()
+_throttle_passed: set[int] = set()
+
+
+def disable_throttling():
+    for observer in THROTTLED_OBSERVERS:
+        observer.middleware.unregister(throttling)
+
+
+async def tagged_throttling(handler, event, data):
+    """
+    Runs the throttling middleware, noting whether it passed the update on.
+    """
+    update_id = data["event_update"].update_id
+    _throttle_seen.add(update_id)
+
+    async def passed(event, data):
+        _throttle_passed.add(update_id)
+        return await handler(event, data)
+
+    return await throttling(passed, event, data)
+
+
+def tag_throttling():
+    for observer in THROTTLED_OBSERVERS:
+        observer.middleware.unregister(throttling)
+        observer.middleware(tagged_throttling)
+
+
+def dropped(update_id: int) -> bool:
+    return update_id in _throttle_seen and update_id not in _throttle_passed
+
+
+def throttled_counts() -> tuple[int, int]:
+    """Updates dropped by the throttling middleware so far: (throttled, coalesced)."""
+    throttled = coalesced = 0
+    for name, count in throttling.stats.items():
+        if name.endswith(".throttled"):
+            throttled += count
+        elif name.endswith(".coalesced"):
+            coalesced += count
+    return throttled, coalesced
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+async def run_level(url: str, concurrency: int, chats: int, first_chat: int, source):
+    """
+    Runs the given number of chats, at most `concurrency` of them at a time.
+    """
+    latencies, errors, drops = [], 0, 0
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_chat(http: ClientSession, chat_id: int):
+        nonlocal errors, drops
+        async with limit:
+            async for update in source(chat_id):
+                started = time.perf_counter()
+                try:
+                    async with http.post(url, json=update) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except Exception:
+                    errors += 1
+                # updates are handled before the response, the tag is already set
+                if dropped(update["update_id"]):
+                    drops += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession() as http:
+        await asyncio.gather(
+            *(run_chat(http, chat_id) for chat_id in range(first_chat, first_chat + chats))
+        )
+    return latencies, drops, errors, time.perf_counter() - started
+
+
+async def main(args: argparse.Namespace):
+    await init_db()
+    stats = DatabaseStats()
+    if args.throttle:
+        tag_throttling()
+    else:
+        disable_throttling()
+
+    # fake telegram
+    api = web.Application()
+    api.router.add_route("*", "/bot{token}/{method}", bot_api_handler)
+    api_runner = web.AppRunner(api)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, args.host, args.api_port).start()
+
+    # application under test, handling updates inline so the latency covers the handlers
+    bot = Bot(
+        token=TOKEN,
+        session=AiohttpSession(
+            api=TelegramAPIServer.from_base(f"http://{args.host}:{args.api_port}")
+        ),
+    )
+    dp = Dispatcher()
+    dp.include_router(router)
+    app = web.Application()
+    SimpleRequestHandler(dp, bot, handle_in_background=False).register(app, "/webhook")
+    app_runner = web.AppRunner(app)
+    await app_runner.setup()
+    await web.TCPSite(app_runner, args.host, args.port).start()
+
+    url = f"http://{args.host}:{args.port}/webhook"
+    source = (lambda chat_id: replay(args.replay, chat_id)) if args.replay else scenario
+
+    print(f"database: {os.environ['DB_DSN']}")
+    print(f"throttling: {'on' if args.throttle else 'off'}")
+    print(
+        f"{'conc':>5} {'updates':>8} {'handled':>8} {'upd/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+        f" {'errors':>7} {'thrtl':>6} {'coal':>6}"
+        f" {'queries':>8} {'db busy':>8} {'max q ms':>9} {'locked':>7}"
+    )
+    first_chat = 1_000_000
+    for concurrency in args.concurrency:
+        stats.reset()
+        dropped_before = throttled_counts()
+        handled, drops, errors, elapsed = await run_level(
+            url, concurrency, args.chats, first_chat, source
+        )
+        first_chat += args.chats
+        throttled, coalesced = (
+            now - before for now, before in zip(throttled_counts(), dropped_before)
+        )
+        print(
+            f"{concurrency:>5} {len(handled) + drops:>8} {len(handled):>8} {len(handled) / elapsed:>8.1f}"
+            f" {percentile(handled, 0.5) * 1000:>8.1f} {percentile(handled, 0.99) * 1000:>8.1f}"
+            f" {errors:>7} {throttled:>6} {coalesced:>6}"
+            f" {stats.statements:>8} {stats.busy / elapsed:>8.0%}"
+            f" {stats.slowest * 1000:>9.1f} {stats.locked:>7}"
+        )
+
+    await app_runner.cleanup()
+    await bot.session.close()
+    await api_runner.cleanup()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--concurrency",
+        type=lambda v: [int(x) for x in v.split(",")],
+        default=[1, 8, 32, 128],
+        help="comma separated concurrency levels (chats in flight)",
+    )
+    parser.add_argument("--chats", type=int, default=128, help="chats per level")
+    parser.add_argument("--replay", help="JSON lines file with captured updates")
+    parser.add_argument(
+        "--throttle", action="store_true", help="keep the command throttling middleware on"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080, help="application port")
+    parser.add_argument("--api-port", type=int, default=18081, help="fake Bot API port")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        sys.exit(1)